@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Topic coherence (UMass and NPMI) of LDA topics, computed from the document
+co-occurrences of the top words of the topics in a reference corpus.
+
+The corpus is converted once to a sparse binary document-term matrix, and
+the co-document counts of the top words of a topic are computed with a
+single sparse matrix product (X_k^T X_k for the columns X_k of the topic's
+top words) instead of scanning the documents for every word pair.
+
+Created on Sun Oct 18 2026
+"""
+
+from numpy import array, ones, log, maximum, triu_indices, int8, float64, \
+    errstate, where
+from scipy.sparse import csc_matrix
+
+from lda_gibbs import load_ldac, corpus_to_arrays, summarize_topics
+
+
+def doc_term_matrix(corpus, vocab_size):
+    """Builds the sparse binary document-term matrix (D x V, CSC) of a
+    corpus, i.e., entry (d, w) is 1 if word w occurs in document d.
+
+    Parameters
+
+    corpus      : an LDA-C file name, the token arrays of load_ldac, or an
+                  iterable of documents in the bag-of-words format
+    vocab_size  : the vocabulary size
+
+    """
+
+    if isinstance(corpus, basestring):
+        corpus = load_ldac(corpus)
+    elif not isinstance(corpus, dict):
+        corpus = corpus_to_arrays(corpus)
+    word_ids, doc_ids = corpus['word_ids'], corpus['doc_ids']
+    shape = (len(corpus['doc_lengths']), vocab_size)
+    matrix = csc_matrix((ones(len(word_ids), dtype=int8), (doc_ids, word_ids)),
+                        shape=shape) # duplicates are summed
+    matrix.data[:] = 1
+
+    return matrix
+
+
+def topic_word_matrix(model):
+    """Returns the K x V topic-word matrix of a model: a matrix itself, the
+    posterior mean of a fitted AugmentedCollapsedGibbsSampler (beta_mean if
+    it was estimated, (n_kw + eta) / (n_k + V eta) otherwise), the expected
+    beta of a StochasticCollapsedGibbsSampler, or the beta_mean of a fitted
+    CollapsedVariationalBayes0
+    """
+
+    if hasattr(model, 'expected_beta'):
+        return model.expected_beta()
+    if getattr(model, 'beta_mean', None) is not None:
+        return model.beta_mean
+    if hasattr(model, 'beta_counts'):
+        return ((model.beta_counts + model.implicit_eta)
+                / (model.topic_counts + model.vocab_size * model.eta)[:, None])
+    return model
+
+
+class TopicCoherence(object):
+    """Computes the coherence of topics against a reference corpus, whose
+    document-term matrix is built once and reused for every model.
+    """
+
+    def __init__(self, corpus, vocab_size):
+        """
+        Arguments:
+            corpus - an LDA-C file name, the token arrays of load_ldac, or an
+                     iterable of documents in the bag-of-words format
+            vocab_size - the vocabulary size
+        """
+
+        self.doc_term = doc_term_matrix(corpus, vocab_size)
+        self.num_docs = self.doc_term.shape[0]
+
+    def co_doc_counts(self, word_ids):
+        """Returns the n x n matrix of the number of documents in which both
+        words of a pair of the given words occur (the document frequencies
+        on the diagonal)
+        """
+
+        columns = self.doc_term[:, word_ids].astype(float64)
+        return (columns.T * columns).toarray()
+
+    def score(self, model, measure='umass', topn=20, eps=1e-12):
+        """Computes the coherence of every topic of a model over its topn
+        words, averaged over the word pairs:
+
+            umass - log ((D(w_i, w_j) + 1) / D(w_j)) for the pairs of
+                    words where w_j ranks above w_i (Mimno et al., 2011)
+            npmi  - log (P(w_i, w_j) / (P(w_i) P(w_j))) / -log P(w_i, w_j),
+                    where P are the document probabilities (Bouma, 2009),
+                    with its limits 1 for words that occur together in
+                    every document and -1 for words that never occur
+                    together
+
+        where D are the document (co-)frequencies. Higher is better.
+
+        Arguments:
+            model - a K x V topic-word matrix or a fitted sampler (see
+                    topic_word_matrix)
+            measure - 'umass' or 'npmi'
+            topn - the number of top words of a topic
+            eps - guards log(0) in the NPMI numerator
+
+        Returns an array of the K coherences.
+
+        >>> docs = [[(0, 1), (1, 1), (2, 1)], [(0, 1), (1, 2)],
+        ...         [(0, 2), (1, 1), (3, 1)]]
+        >>> beta = [[.5, .4, .05, .05], [.5, .05, .4, .05], [.05, .05, .5, .4]]
+        >>> TopicCoherence(docs, 4).score(beta, 'npmi', topn=2).round(6).tolist()
+        [1.0, 0.0, -1.0]
+        >>> TopicCoherence(docs, 4).score(beta, 'umass', topn=2).round(6).tolist()
+        [0.287682, -0.405465, 0.0]
+        """
+
+        assert(measure in ('umass', 'npmi'))
+        assert(topn > 1)
+
+        top_words = summarize_topics(topic_word_matrix(model), topn).word_ids
+        lower, upper = triu_indices(top_words.shape[1], 1) # rank lower < upper
+        coherences = []
+        for word_ids in top_words:
+            counts = self.co_doc_counts(word_ids)
+            pair_counts = counts[upper, lower]
+            if measure == 'umass':
+                # w_j (higher rank) is the conditioning word
+                top_freqs = maximum(counts.diagonal()[lower], 1.)
+                pair_scores = log((pair_counts + 1.) / top_freqs)
+            else:
+                probs = counts.diagonal() / float(self.num_docs)
+                joint = pair_counts / float(self.num_docs)
+                pmi = log(maximum(joint, eps)
+                          / maximum(probs[lower] * probs[upper], eps))
+                with errstate(divide='ignore', invalid='ignore'):
+                    pair_scores = pmi / -log(joint)
+                pair_scores = where(joint >= 1., 1.,
+                                    where(joint <= 0., -1., pair_scores))
+            coherences.append(pair_scores.mean())
+
+        return array(coherences)
+
+
+def topic_coherence(model, corpus, measure='umass', topn=20):
+    """Computes the coherence of every topic of a model (see
+    TopicCoherence.score) against a reference corpus
+
+    The scores agree with a direct evaluation of the definitions over the
+    sets of words of the documents:
+
+    >>> from itertools import combinations
+    >>> from numpy import allclose
+    >>> from numpy.random import RandomState
+    >>> rng = RandomState(0)
+    >>> docs = [[(w, 1) for w in set(rng.randint(0, 12, 6).tolist())]
+    ...         for _ in range(40)] + [[(w, 1) for w in range(12)]] * 5
+    >>> beta = rng.dirichlet([.5] * 12, size=4)
+    >>> doc_sets = [set(w for w, _ in doc) for doc in docs]
+    >>> def freq(*words):
+    ...     return float(sum(1 for words_d in doc_sets if set(words) <= words_d))
+    >>> def npmi(w_i, w_j):
+    ...     joint = freq(w_i, w_j) / len(docs)
+    ...     if joint in (0., 1.):
+    ...         return 2. * joint - 1.
+    ...     return (log(joint * len(docs) ** 2 / (freq(w_i) * freq(w_j)))
+    ...             / -log(joint))
+    >>> def brute_force(measure):
+    ...     scores = []
+    ...     for top in (-beta).argsort(axis=1)[:, :5].tolist():
+    ...         pairs = list(combinations(top, 2)) # w_i ranks above w_j
+    ...         if measure == 'umass':
+    ...             scores.append(sum(log((freq(w_i, w_j) + 1.) / max(freq(w_i), 1.))
+    ...                               for w_i, w_j in pairs) / len(pairs))
+    ...         else:
+    ...             scores.append(sum(npmi(w_i, w_j) for w_i, w_j in pairs)
+    ...                           / len(pairs))
+    ...     return scores
+    >>> all(allclose(topic_coherence(beta, docs, measure, topn=5),
+    ...              brute_force(measure)) for measure in ('umass', 'npmi'))
+    True
+    """
+
+    beta = topic_word_matrix(model)
+    return TopicCoherence(corpus, beta.shape[1]).score(beta, measure, topn)
+
+
+if __name__ == '__main__':
+    # checks the scores against a direct evaluation of the definitions
+    import doctest
+    doctest.testmod()
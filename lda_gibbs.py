@@ -5,35 +5,824 @@ Versions:
 
 @author: Clint P. George
 """
-from numpy import zeros, argsort, array
-from numpy.random import seed, dirichlet, random#, multinomial, randint
+import ctypes
+import heapq
+import os
+from collections import namedtuple
+from os.path import join
+from time import time
+from multiprocessing import Pool, Lock, Process, Pipe
+from multiprocessing.sharedctypes import RawArray
+from numpy import zeros, argsort, array, repeat, cumsum, unique, multiply, \
+    int16, int32, int64, uint8, uint16, uint32, float64, iinfo, dtype, \
+    frombuffer, linspace, sort, sqrt, inf, rint, bincount, newaxis, maximum, \
+    moveaxis, divide, float32, arange, hstack, ones, fromstring, minimum, add, \
+    asarray, argpartition, errstate, log, diff, flatnonzero, clip
+from numpy import load, savez
+from numpy.lib.format import open_memmap
+from numpy.random import gamma, RandomState#, multinomial, dirichlet
+from scipy.special import gammaln, psi
 
-   
-def print_topics(beta, id2token, topn=20):
-    num_topics, vocab_size = beta.shape
-    col_names = [id2token[i] for i in xrange(vocab_size)]
-    for k in xrange(num_topics):
-        topic_row = beta[k, :]
-        sorted_index = argsort(topic_row)[::-1][1:topn]
-        print ", ".join("%s(%.2f)" % (col_names[sidx], topic_row[sidx]*100.) for sidx in sorted_index)
+# The smallest value of an optimized Dirichlet parameter, e.g., of the alpha
+# of a topic that is not used by any document
+MIN_PRIOR = 1e-10
+
+# The maximum number of uniforms the sweeps draw from the random number 
+# generator at once (unless a document needs more) 
+UNIFORM_BLOCK = 1 << 16
+
+
+TopicSummary = namedtuple('TopicSummary', ['word_ids', 'probs', 'scores', 'words'])
+
+
+def _top_words(beta, topn, relevance_lambda, word_probs):
+    """Returns the TopicSummary arrays of a single K x V matrix"""
+    
+    beta = asarray(beta, dtype=float64)
+    topn = min(topn, beta.shape[1])
+    if relevance_lambda == 1.: 
+        scores = beta 
+    else: 
+        with errstate(divide='ignore'): 
+            log_beta = log(beta)
+            scores = (relevance_lambda * log_beta 
+                      + (1. - relevance_lambda) * (log_beta - log(word_probs)))
+    
+    # the top n words of all the topics at once, then sorted among themselves 
+    top = argpartition(-scores, topn - 1, axis=1)[:, :topn]
+    rows = arange(beta.shape[0])[:, newaxis]
+    top = top[rows, argsort(-scores[rows, top], axis=1, kind='mergesort')]
+    
+    return top, beta[rows, top], scores[rows, top]
+
+
+def summarize_topics(beta, topn=20, id2token=None, relevance_lambda=1., 
+                     word_probs=None, average=True):
+    """Finds the top words of all the topics, using argpartition over the 
+    whole K x V matrix rather than a full sort per topic. 
+    
+    Parameters
+    
+    beta        : K x V matrix (e.g., beta_mean), or a list or S x K x V 
+                  (memory-mapped) array of S stored Beta samples 
+    topn        : the number of words per topic 
+    id2token    : an optional mapping from word ids to words 
+    relevance_lambda: the words are ranked by the relevance (Sievert and 
+                  Shirley, 2014) lambda log beta_kw + (1 - lambda) 
+                  log (beta_kw / p_w), i.e., by beta_kw for lambda = 1. 
+    word_probs  : the marginal word probabilities p_w for relevance_lambda 
+                  < 1, e.g., the normalized corpus word frequencies. By 
+                  default, the average of the topics. 
+    average     : if True, the samples are averaged (one at a time) into the 
+                  posterior mean, which is summarized. Otherwise, every 
+                  sample is summarized. 
+    
+    Returns a TopicSummary (word_ids, probs, scores, words): the word ids, 
+    probabilities, and scores of the top words sorted by decreasing score, 
+    as K x topn arrays (S x K x topn for the samples if not average), and 
+    the words as nested lists if id2token is given (None otherwise). 
+    
+    """
+    
+    assert(topn > 0 and 0. <= relevance_lambda <= 1.)
+    
+    per_sample = False 
+    if asarray(beta[0]).ndim == 2: # stored samples 
+        if average: 
+            beta_mean = zeros(asarray(beta[0]).shape)
+            for sample in beta: 
+                beta_mean += sample 
+            beta = beta_mean / len(beta)
+        else: 
+            per_sample = True 
+    
+    def marginal(matrix):
+        if word_probs is not None: 
+            return asarray(word_probs, dtype=float64)
+        probs = asarray(matrix, dtype=float64).mean(axis=0)
+        return probs / probs.sum()
+    
+    if per_sample: 
+        summaries = [_top_words(sample, topn, relevance_lambda, marginal(sample)) 
+                     for sample in beta]
+        word_ids, probs, scores = [array(arrays) for arrays in zip(*summaries)]
+    else: 
+        word_ids, probs, scores = _top_words(beta, topn, relevance_lambda, 
+                                             marginal(beta))
+    
+    words = None 
+    if id2token is not None: 
+        lookup = lambda ids: [id2token[wid] for wid in ids]
+        if per_sample: 
+            words = [[lookup(ids) for ids in sample_ids.tolist()] 
+                     for sample_ids in word_ids]
+        else: 
+            words = [lookup(ids) for ids in word_ids.tolist()]
+    
+    return TopicSummary(word_ids, probs, scores, words)
+
+
+def print_topics(beta, id2token, topn=20, relevance_lambda=1.):
+    """Prints the top words (and their probabilities in %) of every topic of 
+    a K x V matrix or of the mean of stored Beta samples (see 
+    summarize_topics) 
+    """
+    
+    summary = summarize_topics(beta, topn, id2token, relevance_lambda)
+    for words, probs in zip(summary.words, summary.probs.tolist()):
+        print ", ".join("%s(%.2f)" % (word, prob*100.) for word, prob in zip(words, probs))
+        
+
+def draw_dirichlet(params, axis=-1, out=None, rng=None):
+    """Draws a Dirichlet sample for every slice of the parameter matrix 
+    along axis (e.g., axis=1 for the rows of beta_counts, axis=0 for the 
+    columns of theta_counts) at once: the gamma variates of all the entries 
+    are drawn in a single call, and they are normalized along axis. 
+    
+    The gamma variates are drawn slice by slice, i.e., they are the same as 
+    the ones numpy.random.dirichlet draws when it's called for every slice 
+    in order, so the samples only differ by rounding errors. 
+    
+    Parameters
+    
+    params      : array of positive floats, the Dirichlet parameters 
+    axis        : the axis of the Dirichlet parameter vectors 
+    out         : an optional array of the shape of params, in which the 
+                  samples are written (e.g., a memory-mapped sample) 
+    rng         : the numpy RandomState of the gamma variates (by default, 
+                  the global one) 
+    
+    """
+    
+    variates = (gamma if rng is None else rng.gamma)(moveaxis(params, axis, -1))
+    if out is None: 
+        variates /= variates.sum(axis=-1, keepdims=True)
+        return moveaxis(variates, -1, axis)
+    divide(variates, variates.sum(axis=-1, keepdims=True), 
+           out=moveaxis(out, axis, -1))
+    return out 
+
+
+def build_alias_table(weights):
+    """Builds a Walker alias table (Vose's method) for the discrete 
+    distribution proportional to weights, so that a draw costs O(1). 
+    
+    Parameters
+    
+    weights     : Sequence of nonnegative floats, length p 
+    
+    Returns a tuple (probs, aliases) of two lists of length p. To draw, pick 
+    a column k uniformly and return k with probability probs[k] or 
+    aliases[k] otherwise. 
+    
+    """
+    
+    num_cols = len(weights)
+    weights_sum = float(sum(weights))
+    probs = [w * num_cols / weights_sum for w in weights]
+    aliases = range(num_cols)
+    small = [k for k in xrange(num_cols) if probs[k] < 1.]
+    large = [k for k in xrange(num_cols) if probs[k] >= 1.]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        aliases[s] = l 
+        probs[l] -= 1. - probs[s]
+        if probs[l] < 1.:
+            small.append(l)
+        else:
+            large.append(l)
+    for k in small + large: # leftovers are 1. up to rounding errors  
+        probs[k] = 1. 
+    
+    return probs, aliases
+
+
+def _add_cell_counts(counts, rows, cols):
+    """Adds the number of occurrences of every (row, col) index pair to a 
+    2-D count array, e.g., the (topic, document) pairs of the word instances 
+    to the theta counts. Only the occurring cells are touched, so there is 
+    no dense temporary of the count array's size (the memory is O(number of 
+    pairs) in addition to the count array). 
+    """
+    
+    num_cols = counts.shape[1]
+    cells, freqs = unique(asarray(rows, dtype=int64) * num_cols + cols, 
+                          return_counts=True)
+    counts[cells // num_cols, cells % num_cols] += freqs.astype(counts.dtype)
+
+
+def count_histograms(counts):
+    """Computes the histogram of the values of every row of a nonnegative
+    integer count matrix (e.g., the n_kd of a topic over the documents) in
+    a single pass.
+
+    Parameters
+
+    counts      : m x n array of nonnegative integers
+
+    Returns a tuple (rows, values, freqs) of arrays: row rows[i] has
+    freqs[i] entries equal to values[i]. Only the positive values are
+    listed, as zeros do not contribute to the fixed-point updates.
+
+    """
+
+    counts = array(counts, dtype=int64)
+    num_rows = counts.shape[0]
+    width = int(counts.max()) + 1 if counts.size else 1
+    keys = counts + (arange(num_rows, dtype=int64) * width)[:, newaxis]
+    hist = bincount(keys.ravel(), minlength=num_rows * width).reshape(num_rows, width)
+    hist[:, 0] = 0
+    rows, values = hist.nonzero()
+
+    return rows, values, hist[rows, values]
+
+
+def optimize_asymmetric_prior(rows, values, freqs, total_values, total_freqs,
+                              prior, max_iter=20, tol=1e-5):
+    """Optimizes an asymmetric Dirichlet prior with Minka's fixed-point
+    iteration, using the histograms of the counts (Wallach, 2008)
+
+        a_k <- a_k sum_n C_k(n) [psi(n + a_k) - psi(a_k)]
+                 / sum_n C(n) [psi(n + a_0) - psi(a_0)]
+
+    where C_k(n) is the number of groups (e.g., documents) with n counts of
+    component k, C(n) is the number of groups with n counts in total, a_0 is
+    the sum of a, and psi is the digamma function. An iteration costs
+    O(number of histogram entries), at most O(num components x max count),
+    rather than O(num groups x num components).
+
+    Parameters
+
+    rows, values, freqs: the histograms of the component counts (see
+                  count_histograms)
+    total_values, total_freqs: the histogram of the group totals
+    prior       : array of positive floats, the initial prior
+    max_iter    : the maximum number of fixed-point iterations
+    tol         : the relative change of the prior at which it stops
+
+    """
+
+    prior = array(prior, dtype=float64)
+    num_components = len(prior)
+    for _ in xrange(max_iter):
+        prior_sum = prior.sum()
+        denom = (total_freqs * (psi(total_values + prior_sum) - psi(prior_sum))).sum()
+        if denom <= 0.:
+            break
+        numers = bincount(rows, weights=freqs * (psi(values + prior[rows])
+                                                 - psi(prior[rows])),
+                          minlength=num_components)
+        new_prior = maximum(prior * numers / denom, MIN_PRIOR)
+        converged = abs(new_prior - prior).max() <= tol * prior.max()
+        prior = new_prior
+        if converged:
+            break
+
+    return prior
+
+
+def optimize_symmetric_prior(values, freqs, total_values, total_freqs, prior,
+                             dim, max_iter=20, tol=1e-5):
+    """Optimizes a symmetric Dirichlet prior of dimension dim with Minka's
+    fixed-point iteration, using the histograms of the counts
+
+        a <- a sum_n C(n) [psi(n + a) - psi(a)]
+               / (dim sum_n T(n) [psi(n + dim a) - psi(dim a)])
+
+    where C(n) is the number of counts (of any component) equal to n and
+    T(n) is the number of groups with n counts in total.
+
+    Parameters
+
+    values, freqs: the histogram of the component counts
+    total_values, total_freqs: the histogram of the group totals
+    prior       : positive float, the initial prior
+    dim         : the dimension of the Dirichlet
+    max_iter    : the maximum number of fixed-point iterations
+    tol         : the relative change of the prior at which it stops
+
+    """
+
+    prior = float(prior)
+    for _ in xrange(max_iter):
+        denom = dim * (total_freqs * (psi(total_values + dim * prior)
+                                      - psi(dim * prior))).sum()
+        if denom <= 0.:
+            break
+        numer = (freqs * (psi(values + prior) - psi(prior))).sum()
+        new_prior = max(prior * numer / denom, MIN_PRIOR)
+        converged = abs(new_prior - prior) <= tol * prior
+        prior = new_prior
+        if converged:
+            break
+
+    return prior
+
+
+def _expand_pairs(pair_word_ids, pair_counts, doc_lengths):
+    """Expands the (word id, word count) pairs of the documents to word 
+    instances in bulk 
+    """
+    
+    doc_lengths = array(doc_lengths, dtype=int32)
+    return {'word_ids': repeat(array(pair_word_ids, dtype=int32), 
+                               array(pair_counts, dtype=int64)), 
+            'doc_ids': repeat(arange(len(doc_lengths), dtype=int32), doc_lengths), 
+            'doc_lengths': doc_lengths}
+
+
+def corpus_to_arrays(corpus):
+    """Converts an iterable of documents in the bag-of-words format to the 
+    token arrays of the sampler, a dict of the int32 arrays 'word_ids' and 
+    'doc_ids' (the word and the document of every word instance, sorted by 
+    document) and 'doc_lengths'. 
+    """
+    
+    pair_word_ids = []
+    pair_counts = []
+    doc_lengths = []
+    for doc in corpus:
+        doc_length = 0
+        for word_id, word_count in doc:
+            pair_word_ids.append(word_id)
+            pair_counts.append(int(word_count))
+            doc_length += int(word_count)
+        doc_lengths.append(doc_length)
+    
+    return _expand_pairs(pair_word_ids, pair_counts, doc_lengths)
+
+
+def corpus_to_pairs(corpus):
+    """Converts a corpus to its (word id, word count) pairs, i.e., without 
+    expanding them to word instances. The corpus is an iterable of documents 
+    in the bag-of-words format or the token arrays of load_ldac (whose runs 
+    of equal words in a document are merged into pairs). 
+    
+    Returns a dict of the arrays 'word_ids', 'counts', and 'doc_ids' of the 
+    pairs (sorted by document) and 'doc_lengths'. 
+    """
+    
+    if isinstance(corpus, dict): 
+        word_ids = asarray(corpus['word_ids'], dtype=int32)
+        doc_lengths = asarray(corpus['doc_lengths'], dtype=int32)
+        doc_ids = repeat(arange(len(doc_lengths), dtype=int32), doc_lengths)
+        run_starts = flatnonzero(hstack([[True], (word_ids[1:] != word_ids[:-1]) 
+                                         | (doc_ids[1:] != doc_ids[:-1])]))
+        run_starts = run_starts[:len(word_ids)] # an empty corpus 
+        return {'word_ids': word_ids[run_starts], 
+                'counts': diff(hstack([run_starts, [len(word_ids)]])).astype(int32), 
+                'doc_ids': doc_ids[run_starts], 
+                'doc_lengths': doc_lengths}
+    
+    pair_word_ids = []
+    pair_counts = []
+    doc_num_pairs = []
+    for doc in corpus: 
+        num_pairs = 0
+        for word_id, word_count in doc: 
+            if word_count > 0: 
+                pair_word_ids.append(word_id)
+                pair_counts.append(int(word_count))
+                num_pairs += 1
+        doc_num_pairs.append(num_pairs)
+    pair_counts = array(pair_counts, dtype=int32)
+    doc_ids = repeat(arange(len(doc_num_pairs), dtype=int32), doc_num_pairs)
+    
+    return {'word_ids': array(pair_word_ids, dtype=int32), 
+            'counts': pair_counts, 
+            'doc_ids': doc_ids, 
+            'doc_lengths': bincount(doc_ids, weights=pair_counts, 
+                                    minlength=len(doc_num_pairs)).astype(int32)}
+
+
+def load_ldac(file_name, chunk_size=10000):
+    """Loads a corpus in the LDA-C format (one document per line, 
+    "N id:count id:count ...") into the token arrays of the sampler (see 
+    corpus_to_arrays) without creating Python objects per word instance. 
+    
+    The first pass reads the number of pairs N of every document, which 
+    sizes the pair arrays. The second pass parses chunk_size lines at a 
+    time with numpy.fromstring and drops the N fields of the chunk, and 
+    the pairs are finally expanded to word instances with numpy.repeat. 
+    
+    Parameters
+    
+    file_name   : the .ldac file 
+    chunk_size  : the number of lines parsed at once 
+    
+    """
+    
+    num_pairs = []
+    with open(file_name) as fp: 
+        for line in fp: 
+            if line.strip(): 
+                num_pairs.append(int(line.split(None, 1)[0]))
+    num_pairs = array(num_pairs, dtype=int64)
+    num_docs = len(num_pairs)
+    pair_offsets = zeros(num_docs + 1, dtype=int64)
+    cumsum(num_pairs, out=pair_offsets[1:])
+    pair_word_ids = zeros(pair_offsets[-1], dtype=int32)
+    pair_counts = zeros(pair_offsets[-1], dtype=int64)
+    
+    def parse_chunk(lines, doc_start):
+        doc_end = doc_start + len(lines)
+        values = fromstring(' '.join(lines).replace(':', ' '), dtype=int64, sep=' ')
+        field_counts = 1 + 2 * num_pairs[doc_start:doc_end]
+        is_pair = ones(len(values), dtype=bool)
+        is_pair[cumsum(field_counts) - field_counts] = False # the N fields 
+        pairs = values[is_pair].reshape(-1, 2)
+        assert(len(pairs) == pair_offsets[doc_end] - pair_offsets[doc_start])
+        pair_word_ids[pair_offsets[doc_start]:pair_offsets[doc_end]] = pairs[:, 0]
+        pair_counts[pair_offsets[doc_start]:pair_offsets[doc_end]] = pairs[:, 1]
+    
+    doc_start = 0
+    lines = []
+    with open(file_name) as fp: 
+        for line in fp: 
+            if line.strip(): 
+                lines.append(line)
+            if len(lines) == chunk_size: 
+                parse_chunk(lines, doc_start)
+                doc_start += len(lines)
+                lines = []
+    if lines: 
+        parse_chunk(lines, doc_start)
+    
+    count_sums = zeros(len(pair_counts) + 1, dtype=int64)
+    cumsum(pair_counts, out=count_sums[1:])
+    doc_lengths = count_sums[pair_offsets[1:]] - count_sums[pair_offsets[:-1]]
+    
+    return _expand_pairs(pair_word_ids, pair_counts, doc_lengths)
+
+
+def _to_shared(arr):
+    """Copies a numpy array to a block of shared memory. Returns the raw 
+    shared array and its (shape, dtype) spec, which are used to create numpy 
+    views of the block in the worker processes (see _shared_view). 
+    """
+    
+    raw = RawArray(ctypes.c_char, max(arr.nbytes, 1))
+    spec = (arr.shape, arr.dtype.str)
+    _shared_view(raw, spec)[...] = arr
+    return raw, spec
+
+
+def _shared_view(raw, spec):
+    shape, dtype = spec
+    return frombuffer(raw, dtype=dtype, count=int(array(shape).prod())).reshape(shape)
+
+
+# The per-process state of the AD-LDA workers (see _init_adlda_worker) 
+_adlda_worker = {}
+
+
+def _init_adlda_worker(sampler, shared, lock):
+    """Initializes an AD-LDA worker process. The worker's copy of the 
+    sampler is bound to the shared theta counts and z, which the workers 
+    update in place for their own documents. The shared beta and topic 
+    counts are read-only snapshots of the global counts during a sweep; 
+    every worker sweeps against a private copy of them and reconciles its 
+    changes into the shared accumulators. 
+    """
+    
+    views = dict((name, _shared_view(raw, spec)) 
+                 for name, (raw, spec) in shared.iteritems())
+    sampler.theta_counts = views['theta_counts']
+    sampler.z = views['z']
+    _adlda_worker['sampler'] = sampler
+    _adlda_worker['views'] = views
+    _adlda_worker['lock'] = lock
+    _adlda_worker['shard_words'] = {}
+
+
+def _adlda_sweep(task):
+    """Sweeps a shard of documents [doc_start, doc_end) in an AD-LDA worker 
+    process and adds the changes of the beta and topic counts to the shared 
+    accumulators. 
+    """
+    
+    doc_start, doc_end, rng_seed, alpha, eta = task
+    sampler = _adlda_worker['sampler']
+    views = _adlda_worker['views']
+    sampler.alpha, sampler.eta = alpha, eta # e.g., optimized hyperparameters 
+    sampler._set_implicit_priors()
+    
+    # the unique words of the shard: only their beta counts can change  
+    
+    shard_words = _adlda_worker['shard_words'].get((doc_start, doc_end))
+    if shard_words is None: 
+        token_start = sampler.doc_offsets[doc_start]
+        token_end = sampler.doc_offsets[doc_end]
+        shard_words = unique(sampler.word_ids[token_start:token_end])
+        _adlda_worker['shard_words'][(doc_start, doc_end)] = shard_words
+    
+    sampler.beta_counts = views['beta_counts'].copy()
+    sampler.topic_counts = views['topic_counts'].copy()
+    sampler.rng = RandomState(rng_seed)
+    sampler._sweep(xrange(doc_start, doc_end))
+    
+    beta_delta = (sampler.beta_counts[:, shard_words] 
+                  - views['beta_counts'][:, shard_words])
+    topic_delta = sampler.topic_counts - views['topic_counts']
+    with _adlda_worker['lock']:
+        views['beta_accum'][:, shard_words] += beta_delta
+        views['topic_accum'] += topic_delta
+
+
+def partition_blocks(doc_lengths, word_freqs, num_parts):
+    """Partitions the documents and the vocabulary into num_parts groups 
+    each, so that the groups have about the same numbers of word instances. 
+    Both are assigned with the longest-processing-time-first rule: the 
+    documents (words) are visited in decreasing length (frequency), and each 
+    is put into the group with the fewest word instances so far. 
+    
+    Parameters
+    
+    doc_lengths : the number of word instances of every document 
+    word_freqs  : the number of word instances of every word 
+    num_parts   : the number of groups 
+    
+    Returns the group ids of the documents and of the words. 
+    """
+    
+    def balanced_parts(sizes):
+        parts = zeros(len(sizes), dtype=int32)
+        heap = [(0, p) for p in xrange(num_parts)]
+        sizes = asarray(sizes).tolist()
+        for i in argsort([-size for size in sizes], kind='mergesort').tolist():
+            load, p = heapq.heappop(heap) # the smallest group 
+            parts[i] = p
+            heapq.heappush(heap, (load + sizes[i], p))
+        return parts
+    
+    return balanced_parts(doc_lengths), balanced_parts(word_freqs)
+
+
+def balance_diagonals(block_tokens, num_trials=100, random_seed=0):
+    """Relabels the word groups of a P x P partition so that the P rounds 
+    of the block-diagonal schedule, where round l processes the blocks 
+    (p, (p + l) % P), are balanced. The time of a round is its largest 
+    block, so the cost of a sweep is sum_l max_p block_tokens[p, (p + l) % P], 
+    and random relabelings (num_trials) are compared against the identity. 
+    
+    Returns the new label of every word group and the cost of a sweep 
+    relative to a perfect balance (N / P word instances per round, >= 1). 
+    """
+    
+    block_tokens = asarray(block_tokens)
+    num_parts = block_tokens.shape[0]
+    rows = arange(num_parts)
+    rounds = (rows[newaxis, :] + rows[:, newaxis]) % num_parts # [l, p] 
+    
+    def cost(labels):
+        relabeled = zeros(block_tokens.shape, dtype=block_tokens.dtype)
+        relabeled[:, labels] = block_tokens 
+        return relabeled[rows[newaxis, :], rounds].max(axis=1).sum()
+    
+    rng = RandomState(random_seed)
+    best_labels, best_cost = rows, cost(rows)
+    for _ in xrange(num_trials): 
+        labels = rng.permutation(num_parts)
+        trial_cost = cost(labels)
+        if trial_cost < best_cost: 
+            best_labels, best_cost = labels, trial_cost 
+    
+    total = block_tokens.sum()
+    return best_labels, (best_cost * num_parts / float(total) if total else 1.)
+
+
+# The per-process state of the block-diagonal workers (see _init_block_worker) 
+_block_worker = {}
+
+
+def _init_block_worker(sampler, shared, blocks):
+    """Initializes a worker process of the block-diagonal parallel sampler. 
+    The worker's copy of the sampler is bound to the shared beta and theta 
+    counts, which the workers update in place: the blocks of a round have 
+    disjoint documents and words. blocks maps a block (p, q) to the indices 
+    of its word instances, their word ids, the document offsets of the 
+    block, and its documents (see _start_block_workers). 
+    """
+    
+    views = dict((name, _shared_view(raw, spec)) 
+                 for name, (raw, spec) in shared.iteritems())
+    sampler.beta_counts = views['beta_counts']
+    sampler.theta_counts = views['theta_counts']
+    _block_worker['sampler'] = sampler
+    _block_worker['views'] = views
+    _block_worker['blocks'] = blocks
+
+
+def _block_sweep(task):
+    """Sweeps the word instances of a block (p, q) in a worker process, i.e., 
+    the word instances of the documents of group p whose words are in group 
+    q. Returns the change of the topic counts. 
+    """
+    
+    block, rng_seed, alpha, eta = task
+    sampler = _block_worker['sampler']
+    views = _block_worker['views']
+    sampler.alpha, sampler.eta = alpha, eta # e.g., optimized hyperparameters 
+    sampler._set_implicit_priors()
+    
+    # the sweeps see the block as the corpus: its word instances are sorted 
+    # by document, and the other documents are empty 
+    
+    token_ids, word_ids, doc_offsets, docs = _block_worker['blocks'][block]
+    sampler.word_ids, sampler.doc_offsets = word_ids, doc_offsets 
+    sampler.z = views['z'][token_ids]
+    sampler.topic_counts = views['topic_counts'].copy()
+    sampler.rng = RandomState(rng_seed)
+    sampler._sweep(docs)
+    
+    views['z'][token_ids] = sampler.z
+    return sampler.topic_counts - views['topic_counts']
+
+
+class MemmapSampleSink(object):
+    """Stores the samples of a run in preallocated memory-mapped .npy files 
+    (one per sample type) in a directory, so that the samples are not kept 
+    in memory. 
+    """
+    
+    def __init__(self, sample_dir, num_samples, specs, counts=None):
+        """
+        Arguments: 
+            sample_dir - the directory of the .npy files (created if needed) 
+            num_samples - the maximum number of samples of each type 
+            specs - a dict {name: (shape, dtype)} of the sample types, which 
+                    are stored in sample_dir/<name>.npy 
+            counts - a dict {name: number of samples} to reopen the existing 
+                     files of a run that is resumed 
+        """
+        
+        if not os.path.isdir(sample_dir): 
+            os.makedirs(sample_dir)
+        self.paths = {}
+        self.counts = {}
+        self.arrays = {}
+        for name, (shape, dtype) in specs.iteritems():
+            self.paths[name] = join(sample_dir, name + '.npy')
+            if counts is not None: 
+                self.counts[name] = counts[name]
+                self.arrays[name] = open_memmap(self.paths[name], mode='r+')
+            else: 
+                self.counts[name] = 0
+                self.arrays[name] = open_memmap(self.paths[name], mode='w+', 
+                                                dtype=dtype, 
+                                                shape=(num_samples,) + tuple(shape))
+    
+    def next_slot(self, name):
+        """Returns the (memory-mapped) array of the next sample of the given 
+        type, into which the sample is written in place. 
+        """
+        
+        slot = self.arrays[name][self.counts[name]]
+        self.counts[name] += 1
+        return slot 
+    
+    def flush(self):
+        """Flushes the samples to the disk"""
+        
+        for array in self.arrays.values():
+            array.flush()
+    
+    def close(self):
+        self.flush()
+        self.arrays = {}
+    
+    def load(self, name):
+        """Returns the stored samples of the given type as a read-only 
+        memory-mapped array, i.e., the samples are read from the disk only 
+        when they are accessed. 
+        """
         
+        return load(self.paths[name], mmap_mode='r')[:self.counts[name]]
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['arrays'] = {}
+        return state
+
 
 class AugmentedCollapsedGibbsSampler():
     
     def __init__(self, corpus, num_topics, vocab_size, alpha, eta, 
                  max_iter, burn_in_iter, spacing=1, store_beta=False, 
-                 store_theta=False, store_z=False, random_seed=1983):
+                 store_theta=False, store_z=False, random_seed=1983, 
+                 mode='standard', mh_steps=2, n_workers=1, 
+                 compact_state=False, sample_dir=None, 
+                 estimate_posterior=False, estimate_variance=False, 
+                 optimize_alpha=None, optimize_eta=False, hyper_interval=50, 
+                 parallel='adlda', alias_refresh=None):
         """
         AugmentedCollapsedGibbsSampler 
         ------------------------------
         
-        This implementation assumes symmetric Dirichlets for the LDA priors.  
+        corpus      : the documents in the bag-of-words format (e.g., a gensim 
+                      BleiCorpus), or a dict of the token arrays 'word_ids' 
+                      and 'doc_lengths' (see load_ldac and corpus_to_arrays) 
+        
+        The prior of beta is a symmetric Dirichlet(eta). The prior of theta 
+        is a symmetric Dirichlet if alpha is a scalar, or an asymmetric 
+        Dirichlet if alpha is a sequence of num_topics values. self.alpha is 
+        always stored as an array of num_topics values. 
+        
+        mode        : the sampling scheme for z. 'standard' evaluates all the 
+                      num_topics terms of the full conditional for every 
+                      word instance. 'sparse' uses the SparseLDA smoothing, 
+                      document, and topic-word buckets, which only visit the 
+                      nonzero topics of the current document and word 
+                      (preferred for large num_topics). 'alias' uses the 
+                      LightLDA Metropolis-Hastings sampler with per-word 
+                      alias tables, whose cost per word instance does not 
+                      depend on num_topics (preferred for thousands of 
+                      topics). Its word proposals come from tables that are 
+                      reused for alias_refresh draws, i.e., they depend on 
+                      past states of the chain, which trades a small bias of 
+                      the stationary distribution for speed. 'vectorized' computes the full conditional of 
+                      every word instance with NumPy operations on the 
+                      count vectors of its document and word, and samples it 
+                      with cumsum and searchsorted (preferred for moderate 
+                      num_topics). 
+        mh_steps    : the number of Metropolis-Hastings cycles (a word 
+                      proposal followed by a document proposal) per word 
+                      instance in the 'alias' mode 
+        alias_refresh: the number of word proposals an alias table of the 
+                      'alias' mode serves before it is rebuilt from the 
+                      current counts (num_topics if None, which amortizes 
+                      the O(num_topics) construction). Smaller values reduce 
+                      the bias from stale tables, and 1 makes every word 
+                      proposal depend on the current state only, i.e., 
+                      every step an exact Metropolis-Hastings step. 
+        n_workers   : the number of worker processes. If it's greater than 1, 
+                      the documents are partitioned into n_workers shards 
+                      of about the same number of word instances, and the 
+                      shards are swept in parallel using the approximate 
+                      distributed LDA (AD-LDA, Newman et al., 2009) scheme: 
+                      every worker samples against its own copy of the 
+                      beta and topic counts, and the changes are merged 
+                      into the global counts after each iteration. The 
+                      sampler state is kept in shared memory. The run is 
+                      reproducible for a given random_seed and n_workers. 
+        parallel    : the parallel scheme of n_workers > 1. 'adlda' is the 
+                      AD-LDA scheme above. 'blocks' partitions the documents 
+                      and the vocabulary into n_workers groups each (see 
+                      partition_blocks and balance_diagonals), and every 
+                      sweep runs n_workers rounds; round l sweeps the blocks 
+                      (p, (p + l) % n_workers) in parallel. The blocks of a 
+                      round share no documents and no words, so every 
+                      worker updates the global document-topic and 
+                      topic-word counts in place, and these counts are 
+                      always exact. Only the topic totals n_k are private 
+                      to the workers within a round and are merged after 
+                      it. The results do not depend on the scheduling of 
+                      the workers. Not available in the 'alias' mode, 
+                      whose document proposals need the topics of all the 
+                      word instances of a document. 
+        compact_state: if True, the count arrays keep pure integer counts 
+                      (uint16 where no count can overflow it, int32 
+                      otherwise), the priors alpha and eta are added only 
+                      when the full conditionals are computed, and z uses 
+                      the smallest unsigned integer type that fits 
+                      num_topics. Otherwise, the count arrays are float64 
+                      arrays that include the priors. See memory_footprint(). 
+        sample_dir  : if given, the stored Beta, Theta, and Z samples are 
+                      written to preallocated memory-mapped files beta.npy, 
+                      theta.npy, and z.npy in this directory instead of 
+                      being kept in memory, and self.Beta, self.Theta, and 
+                      self.Z are lazily loaded (memory-mapped) arrays after 
+                      fit() 
+        estimate_posterior: if True, the Rao-Blackwellized estimates of the 
+                      posterior means of beta and theta, i.e., the averages 
+                      of E[beta | z] and E[theta | z] over the iterations at 
+                      which samples are stored, are accumulated in a 
+                      preallocated buffer and are available as 
+                      self.beta_mean and self.theta_mean after fit(). The 
+                      memory does not depend on the number of iterations. 
+        estimate_variance: if True (requires estimate_posterior), the 
+                      averages of E[beta^2 | z] and E[theta^2 | z] are 
+                      accumulated too, and the posterior variances are 
+                      available as self.beta_var and self.theta_var 
+        optimize_alpha: None (alpha is fixed), 'symmetric', or 'asymmetric'. 
+                      If given, alpha is updated with Minka's fixed-point 
+                      iteration every hyper_interval iterations of the burn 
+                      in period, using the histograms of the document-topic 
+                      counts and of the document lengths (see 
+                      optimize_hyperparameters). An asymmetric alpha learns 
+                      one value per topic. 
+        optimize_eta: if True, eta is updated in the same way, using the 
+                      histograms of the topic-word counts and of the topic 
+                      counts 
+        hyper_interval: the number of iterations between two updates of the 
+                      hyperparameters 
           
         """
         
         self.num_topics = num_topics
         self.vocab_size = vocab_size
-        self.alpha = float(alpha)
+        self.alpha = array(alpha, dtype=float64) * ones(num_topics)
         self.eta = float(eta)
         self.max_iter = max_iter
         self.burn_in_iter = burn_in_iter
@@ -42,49 +831,69 @@ class AugmentedCollapsedGibbsSampler():
         self.store_theta = store_theta
         self.store_z = store_z
         self.random_seed = random_seed
+        self.mode = mode
+        self.mh_steps = mh_steps
+        self.alias_refresh = num_topics if alias_refresh is None else alias_refresh
+        self.n_workers = n_workers
+        self.parallel = parallel
+        self.compact_state = compact_state
+        self.sample_dir = sample_dir
+        self.estimate_posterior = estimate_posterior
+        self.estimate_variance = estimate_variance
+        self.optimize_alpha = optimize_alpha
+        self.optimize_eta = optimize_eta
+        self.hyper_interval = hyper_interval
+        self.sample_sink = None 
         self.Z = []
         self.Theta = []
         self.Beta = []        
         
         assert(self.num_topics > 1)
         assert(self.vocab_size > 1)
-        assert(self.alpha > 0.)
+        assert(self.alpha.shape == (num_topics,) and (self.alpha > 0.).all())
         assert(self.eta > 0.)
         assert(self.max_iter > 1)
         assert(self.max_iter > self.burn_in_iter)
+        assert(self.mode in ('standard', 'sparse', 'alias', 'vectorized'))
+        assert(self.mh_steps > 0)
+        assert(self.alias_refresh > 0)
+        assert(self.n_workers > 0)
+        assert(self.parallel in ('adlda', 'blocks'))
+        # the document proposals of the 'alias' mode need all the word 
+        # instances of a document 
+        assert(self.parallel != 'blocks' or self.mode != 'alias' 
+               or self.n_workers == 1)
+        assert(self.estimate_posterior or not self.estimate_variance)
+        assert(self.optimize_alpha in (None, 'symmetric', 'asymmetric'))
+        assert(self.optimize_alpha != 'symmetric' 
+               or (self.alpha == self.alpha[0]).all())
+        assert(self.hyper_interval > 0)
         
         #######################################################################
         # Process data
         #######################################################################
         
-        self.word_ids = []
-        self.doc_ids = []
-        self.doc_lengths = []  
-        self.doc_word_indices = []  
-        self.num_corpus_words = 0
-        self.num_docs = 0              
-        
-        # Gets the document index for each word instance
-        # Gets the indices of words in a document as a vector
-        for doc in corpus:
-            word_indices = []
-            doc_length = 0
-            for word_id, word_count in doc:
-                for _ in xrange(int(word_count)):                
-                    self.word_ids.append(word_id) # word instance 
-                    self.doc_ids.append(self.num_docs) # document instance 
-                    word_indices.append(self.num_corpus_words)
-                    self.num_corpus_words += 1 # increment the number of words
-                    doc_length += 1
-            self.doc_lengths.append(doc_length)
-            self.doc_word_indices.append(word_indices)
-            self.num_docs += 1 # increment the number of docs 
-            
+        # The word instances are stored as contiguous int32 arrays sorted by 
+        # document: the word instances of document d are 
+        # [doc_offsets[d], doc_offsets[d + 1]) 
+        
+        if not isinstance(corpus, dict): 
+            corpus = corpus_to_arrays(corpus)
+        self.word_ids = array(corpus['word_ids'], dtype=int32) # word instance 
+        self.doc_lengths = array(corpus['doc_lengths'], dtype=int32)
+        self.num_docs = len(self.doc_lengths)
+        self.doc_ids = repeat(arange(self.num_docs, dtype=int32), 
+                              self.doc_lengths) # document instance 
+        assert(len(self.word_ids) == len(self.doc_ids))
+        self.doc_offsets = zeros(self.num_docs + 1, dtype=int64)
+        cumsum(self.doc_lengths, out=self.doc_offsets[1:])
+        self.num_corpus_words = int(self.doc_offsets[-1])
+        
         #######################################################################
 
 
         
-    def draw_multinomial(self, pvals, pvals_sum=1.):
+    def draw_multinomial(self, pvals, pvals_sum=1., u=None):
         """Draw a sample from a multinomial distribution and return the index of 1.
     
         The multinomial distribution is a multivariate generalisation of the 
@@ -99,158 +908,2224 @@ class AugmentedCollapsedGibbsSampler():
         pvals       : Sequence of floats, length p. Probabilities of each of the p 
                       different outcomes. 
         pvals_sum   : sum(pvals_sum), default 1. (It means pvals sums to 1.) 
+        u           : a uniform in [0, 1), drawn from the sampler's random 
+                      number generator if not given 
         
         """
         
         index = 0
-        u = random() * pvals_sum
+        if u is None: 
+            u = self.rng.random_sample()
+        u *= pvals_sum
         cumulative_prob = pvals[0]
         while u > cumulative_prob:
             index += 1
             cumulative_prob += pvals[index]    
         return index  
 
-    def initialize_state(self):
+    def state_dtypes(self):
+        """Returns the data types of z and the count arrays"""
+        
+        if not self.compact_state: 
+            # the smallest signed integer type that fits the topic ids 
+            z_dtype = int16 if self.num_topics <= iinfo(int16).max + 1 else int32
+            return {'z': dtype(z_dtype), 'beta_counts': dtype(float64), 
+                    'theta_counts': dtype(float64), 
+                    'topic_counts': dtype(float64)}
+        
+        for z_dtype in (uint8, uint16, uint32):
+            if self.num_topics <= iinfo(z_dtype).max + 1: 
+                break 
+        
+        # a count can't exceed the word frequency (beta) or the document 
+        # length (theta) 
+        max_word_freq = bincount(self.word_ids).max() if self.num_corpus_words else 0
+        max_doc_length = self.doc_lengths.max() if self.num_docs else 0
+        beta_dtype = uint16 if max_word_freq <= iinfo(uint16).max else int32
+        theta_dtype = uint16 if max_doc_length <= iinfo(uint16).max else int32
+        
+        return {'z': dtype(z_dtype), 'beta_counts': dtype(beta_dtype), 
+                'theta_counts': dtype(theta_dtype), 
+                'topic_counts': dtype(int64)}
+
+
+    def memory_footprint(self):
+        """Returns the memory (in bytes) of the sampler state, i.e., the 
+        word instance arrays, z, and the count arrays (and the alias tables 
+        of the 'alias' mode, an upper bound as their rows are only touched 
+        for the words in use), as a dict with one entry per array and the 
+        'total'. It can be called before fit() to size a job. 
+        """
+        
+        dtypes = self.state_dtypes()
+        footprint = {
+            'word_ids': self.word_ids.nbytes, 
+            'doc_ids': self.doc_ids.nbytes, 
+            'doc_lengths': self.doc_lengths.nbytes, 
+            'doc_offsets': self.doc_offsets.nbytes, 
+            'z': self.num_corpus_words * dtypes['z'].itemsize, 
+            'beta_counts': (self.num_topics * self.vocab_size 
+                            * dtypes['beta_counts'].itemsize), 
+            'theta_counts': (self.num_topics * self.num_docs 
+                             * dtypes['theta_counts'].itemsize), 
+            'topic_counts': self.num_topics * dtypes['topic_counts'].itemsize}
+        if self.mode == 'alias': 
+            footprint['alias_tables'] = self.vocab_size * (
+                self.num_topics * (4 + 4 + self._alias_dtype().itemsize) + 4)
+        footprint['total'] = sum(footprint.values())
+        
+        return footprint
+
+
+    def initialize_state(self, init=None):
         """Initializes z, beta, theta, and topic counts 
+        
+        Arguments: 
+            init - if given, a warm start (see initial_topics): initial 
+                   topic assignments, a state file saved by save_state, or 
+                   a K x V topic-word matrix 
+        
+        RNG contract: all the random numbers of the run are drawn from 
+        self.rng, a numpy RandomState seeded with random_seed (the global 
+        numpy random state is never used). The initial topics are drawn 
+        with a single call self.rng.random_sample(num_corpus_words), i.e., 
+        one uniform u_i per word instance in corpus order, and the topic of 
+        word instance i is the smallest k with 
+        u_i <= cumsum(alpha / sum(alpha))[k]. This is the same stream and 
+        the same inversion as a draw_multinomial(alpha / sum(alpha)) call 
+        per word instance. A warm start from a topic-word matrix draws the 
+        uniforms in the same single call, and a warm start from topic 
+        assignments draws none. 
         """
         
         # Sets seed 
-        seed(seed=self.random_seed)  
+        self.rng = RandomState(self.random_seed)
 
         # Return random integers from the “discrete uniform” distribution in 
         # the “half-open” interval [low, high).
         # self.z = randint(low=0, high=self.num_topics, size=self.num_corpus_words) 
         
-        pvals = zeros(self.num_topics) # multinomial prob. vector 
-        pvals.fill(self.alpha)
-        pvals /= pvals.sum() # makes it sums to 1. 
-        self.z = zeros(self.num_corpus_words)         
+        dtypes = self.state_dtypes()
+        if init is not None: 
+            tids = self.initial_topics(init)
+        else: 
+            pvals = self.alpha / self.alpha.sum() # multinomial prob. vector 
+            tids = cumsum(pvals).searchsorted(self.rng.random_sample(self.num_corpus_words))
+            minimum(tids, self.num_topics - 1, out=tids) # rounding errors 
+        self.z = tids.astype(dtypes['z'])
         
-        self.beta_counts = zeros((self.num_topics, self.vocab_size))
-        self.beta_counts.fill(self.eta)
+        self.beta_counts = zeros((self.num_topics, self.vocab_size), 
+                                 dtype=dtypes['beta_counts'])
+        self.theta_counts = zeros((self.num_topics, self.num_docs), 
+                                  dtype=dtypes['theta_counts'])
+        self.topic_counts = zeros(self.num_topics, dtype=dtypes['topic_counts'])
         
-        self.theta_counts = zeros((self.num_topics, self.num_docs))
-        self.theta_counts.fill(self.alpha)
-        self.topic_counts = zeros(self.num_topics)
+        if not self.compact_state: 
+            self.beta_counts.fill(self.eta)
+            self.theta_counts[...] = self.alpha[:, newaxis]
+        self._set_implicit_priors()
         
-        for i in xrange(self.num_corpus_words):
-            tid = self.draw_multinomial(pvals)
-            self.z[i] = tid
-            self.beta_counts[tid, self.word_ids[i]] += 1.
-            self.topic_counts[tid] += 1.
-            self.theta_counts[tid, self.doc_ids[i]] += 1.
-
-            
+        # the counts are histograms of the (topic, word) and (topic, 
+        # document) pairs of the word instances, added cell by cell, so the 
+        # initialization needs no wide K x V or K x D temporaries 
         
-
-    def fit(self, message_interval=100):
-
-        # Initializes z, beta, theta, and topic counts 
+        K = self.num_topics 
+        _add_cell_counts(self.beta_counts, tids, self.word_ids)
+        _add_cell_counts(self.theta_counts, tids, self.doc_ids)
+        add(self.topic_counts, bincount(tids, minlength=K), 
+            out=self.topic_counts, casting='unsafe')
         
-        self.initialize_state()
+        # Stored samples 
         
-        # Gibbs sampling 
+        self.Z = []
+        self.Theta = []
+        self.Beta = []        
+        self.sample_sink = self._open_sample_sink()
         
-        if message_interval >= self.max_iter: 
-            message_interval = 1
-            
-        print "Number of documents: %d" % self.num_docs
-        print "Number of words in the corpus: %d" % self.num_corpus_words 
-        print "Maximum number of Gibbs iterations: %d" % self.max_iter
-        print "Burn in period: %d" % self.burn_in_iter
-        print "Message interval: %d" % message_interval
-        print "Gibbs sampling" #,
-        print "-"*100
+        # Running sums of the Rao-Blackwellized estimates: a single buffer 
+        # holds the sums of the (first and second) moments of beta and theta 
         
-        # Identifying the constants for the iterations 
-        # This is to speed up 
-        doc_denom = (array(self.doc_lengths) - 1. + self.num_topics * self.alpha) # a constant for k
-        vocab_size_x_eta = self.vocab_size * self.eta
+        self.num_estimates = 0 
+        self.estimates = None 
+        self.beta_mean, self.theta_mean = None, None 
+        self.beta_var, self.theta_var = None, None 
+        if self.estimate_posterior: 
+            num_moments = 2 if self.estimate_variance else 1
+            self.estimates = zeros((num_moments, self.num_topics, 
+                                    self.vocab_size + self.num_docs))
         
-        for iteration in xrange(self.max_iter):
-            
-            if (iteration + 1) % message_interval == 0: 
-                print "lda_acgs: gibbs iter #%d" % (iteration + 1) # ".", # 
-            
-            store_flg = (iteration >= self.burn_in_iter 
-                         and iteration % self.spacing == 0)
-            
-            # Saves augmented beta samples  
+        # The per-word alias tables of the 'alias' mode are allocated and 
+        # built lazily (see _new_alias_tables) 
+        
+        self.alias_tables = None 
+        self.iteration = 0 # the next Gibbs iteration 
+        self.log_likelihoods = []
+        self.metrics = []
+
             
-            if store_flg and self.store_beta:
-                beta = zeros((self.num_topics, self.vocab_size))                    
-                for k in xrange(self.num_topics):                    
-                    beta[k,:] = dirichlet(self.beta_counts[k,:], 1)
-                self.Beta.append(beta)
+        
+
+    def initial_topics(self, init):
+        """Returns the initial topic assignments of a warm start, i.e., the 
+        topics of the word instances in corpus order. init is one of 
+        
+            an array of num_corpus_words topic ids, e.g., the z of a 
+            previous run, which is used as is 
             
-            # Saves augmented theta samples 
+            the file name of a state saved by save_state. The saved z is 
+            used if the state has the same shape as this sampler; otherwise 
+            (e.g., after the corpus was edited) the saved topic-word counts 
+            are used as a topic-word matrix, with eta for the words that 
+            are not in the saved vocabulary 
             
-            if store_flg and self.store_theta:
-                theta = zeros((self.num_topics, self.num_docs))
-                for d in xrange(self.num_docs):                    
-                    theta[:,d] = dirichlet(self.theta_counts[:,d], 1)
-                self.Theta.append(theta) 
-            
-            for i in xrange(self.num_corpus_words): # for each word instance 
-                wid = self.word_ids[i] # word index 
-                did = self.doc_ids[i] # document index 
-                tid = self.z[i] # current topic 
-                
-                
-                # decrements the counts by 1
-                
-                self.beta_counts[tid, wid] -= 1. 
-                self.theta_counts[tid, did] -= 1. 
-                self.topic_counts[tid] -= 1.
-                
-                # computes pvals 
+            a K x V topic-word matrix, e.g., the beta_mean of a previous run 
+            or the expElogbeta of a gensim LdaModel. The rows are normalized, 
+            and the topic of a word instance of word w is drawn from 
+            p(k | w) ∝ alpha_k beta_kw, all the word instances in a single 
+            vectorized pass. 
+        """
+        
+        K, V, N = self.num_topics, self.vocab_size, self.num_corpus_words
+        
+        if isinstance(init, basestring): 
+            state = load(init)
+            shape = state['shape'].tolist()
+            assert(shape[0] == K)
+            if shape == [K, V, self.num_docs, N]: 
+                return state['z'].astype(int64)
+            saved_counts = state['beta_counts']
+            saved_eta = float(state['eta']) if 'eta' in state else self.eta 
+            if saved_counts.dtype.kind in 'iu': # compact, implicit eta 
+                saved_counts = saved_counts + saved_eta 
+            init = zeros((K, V)) + saved_eta 
+            num_words = min(shape[1], V)
+            init[:, :num_words] = saved_counts[:, :num_words]
+        
+        init = asarray(init)
+        if init.ndim == 1: 
+            assert(init.shape == (N,))
+            assert(N == 0 or (init.min() >= 0 and init.max() < K))
+            return init.astype(int64)
+        
+        assert(init.shape == (K, V) and (init >= 0.).all())
+        
+        return self._draw_topics(init, self.word_ids)
 
-                # pvals = zeros(self.num_topics) # multinomial prob. vector 
-                # Note: I found that using numpy data strutures slows down 
-                #       execution. That's why the below lines are commented 
-                #       and followed a pure python approach (See below). 
-                #       The analysis is performed based on the python package 
-                #       cProfile, pstats, etc. 
-                # pvals = zeros(self.num_topics)              
-                # for k in xrange(self.num_topics):
-                #     pvals[k] = ((self.theta_counts[k, did] / doc_denom[did]) 
-                #                 * (self.beta_counts[k, wid]  
-                #                   / (self.topic_counts[k] + vocab_size_x_eta)))
 
-                pvals = []                
-                pvals_sum = 0.
-                for k in xrange(self.num_topics):
-                    pval = ((self.theta_counts[k, did] / doc_denom[did]) 
-                            * (self.beta_counts[k, wid]  
-                              / (self.topic_counts[k] + vocab_size_x_eta)))
-                    pvals.append(pval)
-                    pvals_sum += pval
+    def _draw_topics(self, topic_word, word_ids):
+        """Draws the topics of word instances from p(k | w) ∝ alpha_k 
+        beta_kw, where beta is the K x V topic-word matrix topic_word with 
+        normalized rows, in a single vectorized pass (len(word_ids) uniforms 
+        in a single call of self.rng) 
+        """
+        
+        K, V = topic_word.shape 
+        topic_word = topic_word / maximum(topic_word.sum(axis=1, keepdims=True), 
+                                          MIN_PRIOR)
+        word_topic = topic_word.T * self.alpha 
+        unseen = (word_topic.sum(axis=1) == 0.) # falls back to the prior 
+        word_topic[unseen] = self.alpha 
+        
+        # the per-word cdfs are shifted by the word ids and flattened, so a 
+        # single searchsorted of wid + u finds the topics of all the word 
+        # instances 
+        cdfs = cumsum(word_topic, axis=1)
+        cdfs /= cdfs[:, -1:]
+        cdfs[:, -1] = 1.
+        cdfs += arange(V)[:, newaxis]
+        
+        uniforms = self.rng.random_sample(len(word_ids))
+        tids = cdfs.ravel().searchsorted(word_ids + uniforms) - word_ids.astype(int64) * K
+        
+        return clip(tids, 0, K - 1) # rounding errors 
 
-                # Multinomial sampling 
 
-                # Note: multinomial requires the vector pvals to sums to 1. 
-                #       If we are using draw_multinomial it's not required.
-                #       In addition, we found that the numpy multinomial 
-                #       is slower than draw_multinomial   
-                # tid =  multinomial(1, pvals/pvals_sum, size=1).argmax()  
-                tid = self.draw_multinomial(pvals, pvals_sum)
-                
-                # increments the counts by 1 
+    def _set_implicit_priors(self):
+        """Sets the prior pseudo-counts that are not stored in the count 
+        arrays, i.e., that are added when the full conditionals are computed 
+        """
+        
+        if self.compact_state: 
+            self.implicit_eta = self.eta 
+            self.implicit_alpha = self.alpha.copy()
+        else: 
+            self.implicit_eta = 0.
+            self.implicit_alpha = zeros(self.num_topics)
 
-                self.beta_counts[tid, wid] += 1.
-                self.theta_counts[tid, did] += 1.
-                self.topic_counts[tid] += 1.                
-                self.z[i] = tid
-                
-            # Saves z samples 
-            if store_flg and self.store_z: 
-                self.Z.append(self.z)
 
-                   
-        print "-"*100
-        print "Number of saved z samples: %d" % len(self.Z)
-        print "Number of saved beta samples: %d" % len(self.Beta)
-        print "Number of saved theta samples: %d" % len(self.Theta)
+    def optimize_hyperparameters(self, max_iter=20, tol=1e-5):
+        """Updates alpha (if optimize_alpha) and eta (if optimize_eta) with 
+        Minka's fixed-point iteration given the current z. 
+        
+        The histograms of the document-topic counts n_kd (one per topic for 
+        an asymmetric alpha) and of the topic-word counts n_kw are built in 
+        a single pass over the count arrays, and then every fixed-point 
+        iteration only visits the histogram entries, whose number is at 
+        most the largest count times num_topics (see 
+        optimize_asymmetric_prior). The prior pseudo-counts included in the 
+        count arrays are shifted to the new values. 
+        """
+        
+        if self.optimize_alpha is not None: 
+            doc_topic = rint(self.theta_counts - (self.alpha 
+                                                  - self.implicit_alpha)[:, newaxis])
+            length_values, length_freqs = unique(self.doc_lengths, 
+                                                 return_counts=True)
+            if self.optimize_alpha == 'asymmetric': 
+                rows, values, freqs = count_histograms(doc_topic)
+                alpha = optimize_asymmetric_prior(rows, values, freqs, 
+                                                  length_values, length_freqs, 
+                                                  self.alpha, max_iter, tol)
+            else: 
+                _, values, freqs = count_histograms(doc_topic.reshape(1, -1))
+                alpha = optimize_symmetric_prior(values, freqs, length_values, 
+                                                 length_freqs, self.alpha[0], 
+                                                 self.num_topics, max_iter, tol)
+                alpha = alpha * ones(self.num_topics)
+            if not self.compact_state: 
+                self.theta_counts += (alpha - self.alpha)[:, newaxis]
+            self.alpha = alpha 
+        
+        if self.optimize_eta: 
+            folded_eta = self.eta - self.implicit_eta 
+            word_topic = rint(self.beta_counts - folded_eta)
+            _, values, freqs = count_histograms(word_topic.reshape(1, -1))
+            topic_values, topic_freqs = unique(self.topic_counts, return_counts=True)
+            eta = optimize_symmetric_prior(values, freqs, topic_values, 
+                                           topic_freqs, self.eta, 
+                                           self.vocab_size, max_iter, tol)
+            if not self.compact_state: 
+                self.beta_counts += eta - self.eta 
+                if hasattr(self, '_beta_accum'): # AD-LDA accumulators 
+                    self._beta_accum += eta - self.eta 
+            self.eta = eta 
+        
+        self._set_implicit_priors()
+
 
+    def num_stored_samples(self):
+        """Returns the number of samples stored by a run, i.e., the number 
+        of iterations from burn_in_iter to max_iter that are multiples of 
+        spacing. 
+        """
+        
+        first = -(-self.burn_in_iter // self.spacing) * self.spacing
+        return len(xrange(first, self.max_iter, self.spacing))
 
 
+    def _accumulate_estimates(self):
+        """Adds E[beta | z] = (n_kw + eta) / (n_k + V eta) and E[theta | z] 
+        = (n_kd + alpha_k) / (n_d + sum(alpha)) of the current state (and the 
+        second moments of the Dirichlet conditionals, E[x^2 | z] = 
+        E[x | z] (a + 1) / (a_sum + 1) for the parameter a) to the running sums. 
+        """
+        
+        beta_sums = self.estimates[:, :, :self.vocab_size]
+        theta_sums = self.estimates[:, :, self.vocab_size:]
+        beta_params = self.beta_counts + self.implicit_eta
+        beta_params_sum = (self.topic_counts + self.vocab_size * self.eta)[:, newaxis]
+        theta_params = self.theta_counts + self.implicit_alpha[:, newaxis]
+        theta_params_sum = self.doc_lengths + self.alpha.sum()
+        
+        for sums, params, params_sum in ((beta_sums, beta_params, beta_params_sum), 
+                                         (theta_sums, theta_params, theta_params_sum)):
+            mean = params / params_sum 
+            sums[0] += mean 
+            if self.estimate_variance: 
+                params += 1.
+                params /= params_sum + 1. 
+                params *= mean 
+                sums[1] += params 
+        
+        self.num_estimates += 1
+
+
+    def _finalize_estimates(self):
+        """Computes the posterior means (and variances) from the running sums"""
+        
+        if self.estimates is None or self.num_estimates == 0: 
+            return 
+        moments = self.estimates / self.num_estimates
+        self.beta_mean = moments[0, :, :self.vocab_size]
+        self.theta_mean = moments[0, :, self.vocab_size:]
+        if self.estimate_variance: 
+            moments[1] -= moments[0] ** 2
+            maximum(moments[1], 0., out=moments[1]) # rounding errors 
+            self.beta_var = moments[1, :, :self.vocab_size]
+            self.theta_var = moments[1, :, self.vocab_size:]
+
+
+    def _open_sample_sink(self, counts=None):
+        """Creates the sample sink of the run, if there is a sample_dir"""
+        
+        if self.sample_dir is None or self.num_stored_samples() == 0: 
+            return None 
+        specs = {}
+        if self.store_beta: 
+            specs['beta'] = ((self.num_topics, self.vocab_size), float64)
+        if self.store_theta: 
+            specs['theta'] = ((self.num_topics, self.num_docs), float64)
+        if self.store_z: 
+            specs['z'] = ((self.num_corpus_words,), self.z.dtype)
+        
+        return MemmapSampleSink(self.sample_dir, self.num_stored_samples(), 
+                                specs, counts)
+
+
+    def _close_sample_sink(self):
+        """Flushes the sample sink and exposes the stored samples as lazily 
+        loaded arrays 
+        """
+        
+        if self.sample_sink is None: 
+            return 
+        self.sample_sink.close()
+        self._load_samples()
+
+
+    def _load_samples(self):
+        if self.store_beta: 
+            self.Beta = self.sample_sink.load('beta')
+        if self.store_theta: 
+            self.Theta = self.sample_sink.load('theta')
+        if self.store_z: 
+            self.Z = self.sample_sink.load('z')
+
+
+    def __getstate__(self):
+        # the samples in the sample sink are not copied (e.g., to the 
+        # processes of run_chains) but loaded from the disk again 
+        state = self.__dict__.copy()
+        if self.sample_sink is not None: 
+            for name in ('Beta', 'Theta', 'Z'):
+                state[name] = []
+        return state 
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.sample_sink is not None and not self.sample_sink.arrays: 
+            self._load_samples()
+
+
+    def fit(self, message_interval=100, checkpoint_file=None, 
+            checkpoint_interval=300., resume_from=None, ll_interval=None, 
+            ll_window=10, ll_tol=None, callbacks=None, verbose=True, 
+            init=None):
+        """Runs the Gibbs sampler. 
+        
+        Arguments: 
+            message_interval - the number of iterations between messages 
+            checkpoint_file - if given, the complete sampler state is saved 
+                              to this file (see save_state) at least every 
+                              checkpoint_interval seconds and at the end of 
+                              the run 
+            checkpoint_interval - the minimum time (in seconds) between two 
+                                  checkpoints 
+            resume_from - a checkpoint file of an interrupted run with the 
+                          same corpus and settings. The run continues from 
+                          the checkpoint and gives the same results as an 
+                          uninterrupted run (except in the 'alias' mode with 
+                          n_workers > 1, whose workers' alias tables are 
+                          not saved). 
+            ll_interval - if given, the joint log-likelihood log p(w, z) is 
+                          computed every ll_interval iterations and appended 
+                          to the trace self.log_likelihoods, a list of 
+                          (iteration, log-likelihood) pairs 
+            ll_window - the number of log-likelihood evaluations over which 
+                        the relative change is measured for ll_tol 
+            ll_tol - if given (requires ll_interval), the run stops after the 
+                     burn in period once the relative change of the 
+                     log-likelihood over the last ll_window evaluations 
+                     falls below ll_tol 
+            callbacks - a list of functions callback(sampler, metrics), 
+                        which are called after every iteration with the 
+                        metrics of the iteration (see _run_iterations). 
+                        The run stops after the iteration if a callback 
+                        returns True. 
+            verbose - if False, fit() does not print anything 
+            init - a warm start (see initial_topics): initial topic 
+                   assignments, a state file saved by save_state, or a K x V 
+                   topic-word matrix. Unlike resume_from, the run starts 
+                   over at iteration 0 with a fresh random number generator, 
+                   and only the initial z comes from init. 
+        
+        The metrics of all the iterations are kept in self.metrics. 
+        """
+        
+        assert(ll_tol is None or (ll_interval > 0 and ll_window > 0))
+        assert(resume_from is None or init is None)
+
+        # Initializes z, beta, theta, and topic counts 
+        
+        if resume_from is not None: 
+            self.load_state(resume_from)
+        else: 
+            self.initialize_state(init)
+        
+        # Gibbs sampling 
+        
+        if message_interval >= self.max_iter: 
+            message_interval = 1
+        
+        if verbose: 
+            print "Number of documents: %d" % self.num_docs
+            print "Number of words in the corpus: %d" % self.num_corpus_words 
+            print "Maximum number of Gibbs iterations: %d" % self.max_iter
+            print "Burn in period: %d" % self.burn_in_iter
+            print "Message interval: %d" % message_interval
+            print "Sampler memory footprint: %.1f MB" % (self.memory_footprint()['total'] / 2.**20)
+            print "Gibbs sampling" #,
+            print "-"*100
+        
+        pool, shards = None, None 
+        if self.n_workers > 1: 
+            pool, shards = self._start_workers()
+        
+        try: 
+            self._run_iterations(message_interval, self.max_iter, pool, shards, 
+                                 checkpoint_file, checkpoint_interval, 
+                                 ll_interval, ll_window, ll_tol, callbacks, 
+                                 verbose)
+        finally:
+            if pool is not None: 
+                self._stop_workers(pool)
+        if checkpoint_file is not None: 
+            self.save_state(checkpoint_file)
+        self._close_sample_sink()
+        self._finalize_estimates()
+        
+        if verbose: 
+            print "-"*100
+            print "Number of saved z samples: %d" % len(self.Z)
+            print "Number of saved beta samples: %d" % len(self.Beta)
+            print "Number of saved theta samples: %d" % len(self.Theta)
+
+
+    def save_state(self, file_name):
+        """Saves the complete sampler state, i.e., z, the count arrays, the 
+        state of the random number generator, the iteration number, the 
+        alias tables, the stored samples (or the sample counts of the sample 
+        sink), and the running sums of the estimates, to a numpy .npz file. 
+        
+        The file is written to a temporary file first, which then replaces 
+        file_name, so an interrupted write never corrupts the checkpoint. 
+        """
+        
+        rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = self.rng.get_state()
+        state = {'iteration': self.iteration, 
+                 'shape': [self.num_topics, self.vocab_size, self.num_docs, 
+                           self.num_corpus_words], 
+                 'z': self.z, 
+                 'beta_counts': self.beta_counts, 
+                 'theta_counts': self.theta_counts, 
+                 'topic_counts': self.topic_counts, 
+                 'rng_keys': rng_keys, 
+                 'rng_state': [rng_pos, rng_has_gauss, rng_gauss], 
+                 'num_estimates': self.num_estimates, 
+                 'alpha': self.alpha, 
+                 'eta': self.eta, 
+                 'log_likelihoods': array(self.log_likelihoods).reshape(-1, 2)}
+        if self.estimates is not None: 
+            state['estimates'] = self.estimates
+        if self.sample_sink is not None: 
+            self.sample_sink.flush()
+            for name, count in self.sample_sink.counts.iteritems():
+                state['sink_' + name] = count 
+        else: 
+            for name, samples in (('Beta', self.Beta), ('Theta', self.Theta), 
+                                  ('Z', self.Z)):
+                if len(samples): 
+                    state[name] = array(samples)
+        if self.alias_tables is not None: # only the tables in use 
+            wids = flatnonzero(self.alias_tables['draws'] > 0)
+            state['alias_wids'] = wids
+            for name in ('probs', 'aliases', 'weights', 'draws'):
+                state['alias_' + name] = self.alias_tables[name][wids]
+        
+        temp_file_name = file_name + '.tmp'
+        with open(temp_file_name, 'wb') as fp: 
+            savez(fp, **state)
+            fp.flush()
+            os.fsync(fp.fileno())
+        if os.name == 'nt' and os.path.exists(file_name): 
+            os.remove(file_name) # rename doesn't replace files on Windows 
+        os.rename(temp_file_name, file_name)
+
+
+    def load_state(self, file_name):
+        """Loads a sampler state saved by save_state, e.g., to resume a run"""
+        
+        state = load(file_name)
+        assert(state['shape'].tolist() == [self.num_topics, self.vocab_size, 
+                                           self.num_docs, 
+                                           self.num_corpus_words])
+        
+        self.iteration = int(state['iteration'])
+        self.metrics = []
+        self.log_likelihoods = [(int(iteration), ll) for iteration, ll 
+                                in state['log_likelihoods'].tolist()]
+        self.z = state['z']
+        self.beta_counts = state['beta_counts']
+        self.theta_counts = state['theta_counts']
+        self.topic_counts = state['topic_counts']
+        if 'alpha' in state: 
+            self.alpha = state['alpha']
+            self.eta = float(state['eta'])
+        self._set_implicit_priors()
+        rng_pos, rng_has_gauss, rng_gauss = state['rng_state'].tolist()
+        self.rng = RandomState()
+        self.rng.set_state(('MT19937', state['rng_keys'], int(rng_pos), 
+                            int(rng_has_gauss), rng_gauss))
+        
+        self.num_estimates = int(state['num_estimates'])
+        self.estimates = state['estimates'] if 'estimates' in state else None 
+        self.beta_mean, self.theta_mean = None, None 
+        self.beta_var, self.theta_var = None, None 
+        
+        self.Z = []
+        self.Theta = []
+        self.Beta = []        
+        counts = dict((name[len('sink_'):], int(state[name])) 
+                      for name in state.files if name.startswith('sink_'))
+        self.sample_sink = self._open_sample_sink(counts) if counts else None 
+        for name in ('Beta', 'Theta', 'Z'):
+            if name in state: 
+                setattr(self, name, list(state[name]))
+        
+        self.alias_tables = None 
+        if 'alias_wids' in state: 
+            self.alias_tables = self._new_alias_tables()
+            wids = state['alias_wids']
+            for name in ('probs', 'aliases', 'weights', 'draws'):
+                self.alias_tables[name][wids] = state['alias_' + name]
+
+
+    def transform(self, corpus, num_sweeps=20, method='gibbs', batch_size=256, 
+                  n_workers=1):
+        """Infers the topic proportions of new documents by folding them in, 
+        i.e., the topic-word distributions are frozen at the current posterior 
+        mean (n_kw + eta) / (n_k + V eta) of the fitted sampler, and only the 
+        topic assignments of the new documents are updated. 
+        
+        The documents are processed in batches, and every update works on 
+        all the documents of a batch at once. Words that are not in the 
+        vocabulary are ignored. 
+        
+        Arguments: 
+            corpus - the new documents, in the same format as the corpus of 
+                     the constructor, e.g., a gensim BleiCorpus 
+            num_sweeps - the number of fold-in sweeps per document 
+            method - 'gibbs' for collapsed Gibbs sampling, where theta is 
+                     the average of the Rao-Blackwellized estimates over 
+                     the second half of the sweeps, or 'cvb0' for the 
+                     (deterministic) zero-order collapsed variational Bayes 
+                     updates on the unique words of a document 
+            batch_size - the number of documents of a batch 
+            n_workers - the number of processes that process the batches 
+        
+        Returns a num_topics x number of documents matrix (as Theta). The 
+        result depends on random_seed but not on n_workers. 
+        """
+        
+        assert(method in ('gibbs', 'cvb0'))
+        assert(num_sweeps > 0 and batch_size > 0 and n_workers > 0)
+        
+        word_topic = ((self.beta_counts + self.implicit_eta).T 
+                      / (self.topic_counts + self.vocab_size * self.eta))
+        
+        return fold_in_corpus(corpus, word_topic, self.alpha, num_sweeps, 
+                              method, batch_size, n_workers, self.random_seed)
+
+
+    def add_documents(self, corpus, vocab_size=None, num_sweeps=10, 
+                      num_old_docs=None):
+        """Adds documents to a fitted (or initialized) sampler without 
+        refitting the whole corpus. 
+        
+        The word instances of the new documents are appended to the corpus 
+        arrays, the beta counts get new columns if the vocabulary grew, and 
+        the theta counts get a column per new document. The topics of the 
+        new word instances are drawn from the current topic-word posterior 
+        mean (n_kw + eta) / (n_k + V eta) (see initial_topics), and then 
+        num_sweeps Gibbs sweeps are run over the new documents and a fresh 
+        random sample of num_old_docs old documents per sweep. So, the cost 
+        of an update depends on the size of the update, not of the corpus 
+        (except for copying the arrays). 
+        
+        Arguments: 
+            corpus - the new documents in the bag-of-words format, or a dict 
+                     of the token arrays 'word_ids' and 'doc_lengths' 
+            vocab_size - the new vocabulary size (the new words take the ids 
+                         vocab_size, vocab_size + 1, ...). Defaults to the 
+                         current size or the largest new word id + 1. 
+            num_sweeps - the number of sweeps of the update 
+            num_old_docs - the number of old documents in every sweep 
+                           (defaults to the number of new documents) 
+        
+        The stored samples are kept as they are, i.e., for the old corpus, 
+        and the running sums of the posterior estimates are reset. To 
+        continue sampling the whole corpus, use fit(init=self.z). The sweeps 
+        run in this process, also if n_workers > 1. 
+        """
+        
+        assert(hasattr(self, 'z')) # requires initialize_state or fit 
+        assert(num_sweeps >= 0)
+        
+        if not isinstance(corpus, dict): 
+            corpus = corpus_to_arrays(corpus)
+        new_word_ids = array(corpus['word_ids'], dtype=int32)
+        new_doc_lengths = array(corpus['doc_lengths'], dtype=int32)
+        num_new_docs = len(new_doc_lengths)
+        num_new_words = int(new_doc_lengths.sum())
+        assert(len(new_word_ids) == num_new_words)
+        if vocab_size is None: 
+            vocab_size = max(self.vocab_size, 
+                             int(new_word_ids.max()) + 1 if num_new_words else 0)
+        assert(vocab_size >= self.vocab_size)
+        assert(num_new_words == 0 or new_word_ids.max() < vocab_size)
+        old_num_docs = self.num_docs
+        if num_old_docs is None: 
+            num_old_docs = num_new_docs 
+        num_old_docs = min(num_old_docs, old_num_docs)
+        
+        K = self.num_topics 
+        
+        # Grows the vocabulary 
+        
+        if vocab_size > self.vocab_size: 
+            new_columns = zeros((K, vocab_size - self.vocab_size), 
+                                dtype=self.beta_counts.dtype)
+            if not self.compact_state: 
+                new_columns.fill(self.eta)
+            self.beta_counts = hstack([self.beta_counts, new_columns])
+            self.vocab_size = vocab_size
+            self.alias_tables = None # rebuilt on use for the new vocabulary 
+        
+        # Draws the topics of the new word instances from the current 
+        # topic-word posterior, and appends the word instances 
+        
+        topic_word = ((self.beta_counts + self.implicit_eta) 
+                      / (self.topic_counts + self.vocab_size * self.eta)[:, newaxis])
+        tids = self._draw_topics(topic_word, new_word_ids)
+        new_doc_ids = repeat(arange(old_num_docs, old_num_docs + num_new_docs, 
+                                    dtype=int32), new_doc_lengths)
+        
+        self.word_ids = hstack([self.word_ids, new_word_ids])
+        self.doc_ids = hstack([self.doc_ids, new_doc_ids])
+        self.doc_lengths = hstack([self.doc_lengths, new_doc_lengths])
+        self.doc_offsets = hstack([self.doc_offsets, 
+                                   self.num_corpus_words + cumsum(new_doc_lengths)])
+        self.num_docs += num_new_docs 
+        self.num_corpus_words += num_new_words 
+        
+        # Updates the counts. The compact dtypes may have to grow with the 
+        # word frequencies and document lengths. 
+        
+        dtypes = self.state_dtypes()
+        self.z = hstack([self.z, tids]).astype(dtypes['z'])
+        new_columns = zeros((K, num_new_docs), dtype=self.theta_counts.dtype)
+        if not self.compact_state: 
+            new_columns[...] = self.alpha[:, newaxis]
+        self.theta_counts = hstack([self.theta_counts, new_columns])
+        for name in ('beta_counts', 'theta_counts', 'topic_counts'): 
+            if getattr(self, name).dtype != dtypes[name]: 
+                setattr(self, name, getattr(self, name).astype(dtypes[name]))
+        
+        _add_cell_counts(self.beta_counts, tids, new_word_ids)
+        _add_cell_counts(self.theta_counts, tids, new_doc_ids)
+        add(self.topic_counts, bincount(tids, minlength=K), 
+            out=self.topic_counts, casting='unsafe')
+        
+        # The estimates are for the old corpus 
+        
+        self.num_estimates = 0 
+        self.beta_mean, self.theta_mean = None, None 
+        self.beta_var, self.theta_var = None, None 
+        if self.estimates is not None: 
+            self.estimates = zeros((self.estimates.shape[0], K, 
+                                    self.vocab_size + self.num_docs))
+        
+        # Sweeps the new documents and samples of the old ones 
+        
+        new_docs = range(old_num_docs, self.num_docs)
+        for _ in xrange(num_sweeps): 
+            old_docs = sort(self.rng.permutation(old_num_docs)[:num_old_docs])
+            self._sweep(old_docs.tolist() + new_docs)
+
+
+    def ll_converged(self, window, tol):
+        """Checks whether the relative change of the log-likelihood trace 
+        over the last window evaluations is below tol 
+        """
+        
+        if len(self.log_likelihoods) <= window: 
+            return False 
+        ll_new = self.log_likelihoods[-1][1]
+        ll_old = self.log_likelihoods[-1 - window][1]
+        
+        return abs(ll_new - ll_old) <= tol * abs(ll_old)
+
+
+    def log_likelihood(self):
+        """Computes the collapsed joint log-likelihood log p(w, z) of the 
+        current state, i.e., the sum of 
+        
+            log p(w | z) = K [log G(V eta) - V log G(eta)] 
+                           + sum_k [sum_w log G(n_kw + eta) - log G(n_k + V eta)] 
+            log p(z) = D [log G(alpha_0) - sum_k log G(alpha_k)] 
+                       + sum_d [sum_k log G(n_kd + alpha_k) - log G(n_d + alpha_0)] 
+        
+        where G is the gamma function and alpha_0 = sum_k alpha_k. 
+        """
+        
+        K, V, D = self.num_topics, self.vocab_size, self.num_docs
+        vocab_size_x_eta = V * self.eta
+        alpha_sum = self.alpha.sum()
+        
+        ll = K * (gammaln(vocab_size_x_eta) - V * gammaln(self.eta))
+        ll += gammaln(self.beta_counts + self.implicit_eta).sum() 
+        ll -= gammaln(self.topic_counts + vocab_size_x_eta).sum()
+        ll += D * (gammaln(alpha_sum) - gammaln(self.alpha).sum())
+        ll += gammaln(self.theta_counts + self.implicit_alpha[:, newaxis]).sum()
+        ll -= gammaln(self.doc_lengths + alpha_sum).sum()
+        
+        return ll 
+
+
+    def _run_iterations(self, message_interval, stop, pool=None, shards=None, 
+                        checkpoint_file=None, checkpoint_interval=None, 
+                        ll_interval=None, ll_window=None, ll_tol=None, 
+                        callbacks=None, verbose=True):
+        """Runs the Gibbs iterations from self.iteration until stop, or until 
+        the log-likelihood converges or a callback returns True (see fit). 
+        
+        The metrics of every iteration are appended to self.metrics as a 
+        dict with the keys 
+            iteration - the number of completed iterations 
+            wall_time - the time (in seconds) of the whole iteration 
+            sampling_time - the time of the sweep 
+            storage_time - the time spent on storing samples and 
+                           accumulating estimates 
+            tokens_per_sec - the number of word instances swept per second 
+            changed_fraction - the fraction of word instances whose topic 
+                               changed in the sweep 
+            log_likelihood - the log-likelihood, if it was computed in the 
+                             iteration (ll_interval), or None 
+        """
+        
+        last_checkpoint = time()
+        while self.iteration < stop:
+            iteration = self.iteration
+            iter_start = time()
+            
+            if verbose and (iteration + 1) % message_interval == 0: 
+                print "lda_acgs: gibbs iter #%d" % (iteration + 1) # ".", # 
+            
+            store_flg = (iteration >= self.burn_in_iter 
+                         and iteration % self.spacing == 0)
+            
+            # Accumulates the Rao-Blackwellized estimates 
+            
+            if store_flg and self.estimates is not None: 
+                self._accumulate_estimates()
+            
+            # Saves augmented beta samples  
+            
+            if store_flg and self.store_beta:
+                beta_params = self.beta_counts + self.implicit_eta
+                if self.sample_sink is not None: 
+                    draw_dirichlet(beta_params, axis=1, 
+                                   out=self.sample_sink.next_slot('beta'), 
+                                   rng=self.rng)
+                else: 
+                    self.Beta.append(draw_dirichlet(beta_params, axis=1, 
+                                                    rng=self.rng))
+            
+            # Saves augmented theta samples 
+            
+            if store_flg and self.store_theta:
+                theta_params = self.theta_counts + self.implicit_alpha[:, newaxis]
+                if self.sample_sink is not None: 
+                    draw_dirichlet(theta_params, axis=0, 
+                                   out=self.sample_sink.next_slot('theta'), 
+                                   rng=self.rng)
+                else: 
+                    self.Theta.append(draw_dirichlet(theta_params, axis=0, 
+                                                     rng=self.rng))
+            
+            sweep_start = time()
+            prev_z = self.z.copy()
+            if pool is not None and self.parallel == 'blocks': 
+                self._sweep_blocks(pool, shards)
+            elif pool is not None: 
+                self._sweep_adlda(pool, shards)
+            else: 
+                self._sweep(xrange(self.num_docs))
+            sweep_end = time()
+            num_changed = int((self.z != prev_z).sum())
+            del prev_z
+                
+            # Saves z samples 
+            if store_flg and self.store_z: 
+                if self.sample_sink is not None: 
+                    self.sample_sink.next_slot('z')[:] = self.z
+                else: 
+                    self.Z.append(self.z.copy())
+            storage_time = (sweep_start - iter_start) + (time() - sweep_end)
+            
+            self.iteration += 1
+            
+            if ((self.optimize_alpha is not None or self.optimize_eta) 
+                and self.iteration <= self.burn_in_iter 
+                and self.iteration % self.hyper_interval == 0): 
+                self.optimize_hyperparameters()
+            
+            ll = None 
+            if ll_interval and self.iteration % ll_interval == 0: 
+                ll = self.log_likelihood()
+                self.log_likelihoods.append((self.iteration, ll))
+                if (ll_tol is not None and self.iteration > self.burn_in_iter 
+                    and self.ll_converged(ll_window, ll_tol)):
+                    if verbose: 
+                        print "lda_acgs: log-likelihood converged at iter #%d" % self.iteration
+                    stop = self.iteration
+            
+            sampling_time = sweep_end - sweep_start
+            metrics = {'iteration': self.iteration, 
+                       'wall_time': time() - iter_start, 
+                       'sampling_time': sampling_time, 
+                       'storage_time': storage_time, 
+                       'tokens_per_sec': (self.num_corpus_words / sampling_time 
+                                          if sampling_time > 0. else inf), 
+                       'changed_fraction': (num_changed / float(self.num_corpus_words) 
+                                            if self.num_corpus_words else 0.), 
+                       'log_likelihood': ll}
+            self.metrics.append(metrics)
+            for callback in callbacks or []: 
+                if callback(self, metrics): 
+                    stop = self.iteration
+            
+            if (checkpoint_file is not None and self.iteration < stop 
+                and time() - last_checkpoint >= checkpoint_interval):
+                self.save_state(checkpoint_file)
+                last_checkpoint = time()
+
+
+    def _sweep(self, docs):
+        """Runs one sweep of the sampling mode over the given documents"""
+        
+        if self.mode == 'sparse':
+            self._sweep_sparse(docs)
+        elif self.mode == 'alias':
+            self._sweep_alias(docs)
+        elif self.mode == 'vectorized':
+            self._sweep_vectorized(docs)
+        else:
+            self._sweep_standard(docs)
+
+
+    def _start_workers(self):
+        """Moves the sampler state to shared memory, partitions the 
+        documents into n_workers shards of about the same number of word 
+        instances, and starts the AD-LDA worker pool. 
+        """
+        
+        if self.parallel == 'blocks': 
+            return self._start_block_workers()
+        
+        shared = {}
+        for name in ('beta_counts', 'topic_counts', 'theta_counts', 'z'):
+            shared[name] = _to_shared(getattr(self, name))
+            setattr(self, name, _shared_view(*shared[name]))
+        shared['beta_accum'] = _to_shared(self.beta_counts)
+        shared['topic_accum'] = _to_shared(self.topic_counts)
+        self._beta_accum = _shared_view(*shared['beta_accum'])
+        self._topic_accum = _shared_view(*shared['topic_accum'])
+        
+        token_bounds = linspace(0, self.num_corpus_words, self.n_workers + 1)
+        doc_bounds = self.doc_offsets.searchsorted(token_bounds).tolist()
+        doc_bounds[0], doc_bounds[-1] = 0, self.num_docs
+        shards = [(doc_bounds[p], doc_bounds[p + 1]) 
+                  for p in xrange(self.n_workers) 
+                  if doc_bounds[p] < doc_bounds[p + 1]]
+        
+        pool = Pool(processes=len(shards), initializer=_init_adlda_worker, 
+                    initargs=(self, shared, Lock()))
+        
+        return pool, shards
+
+
+    def _sweep_adlda(self, pool, shards):
+        """Runs one AD-LDA iteration: the shards are swept in parallel, and 
+        the global beta and topic counts are replaced by the accumulated 
+        counts. The seeds of the workers are drawn from the sampler's random 
+        number generator, which makes a run reproducible. 
+        """
+        
+        seeds = self.rng.randint(iinfo(int32).max, size=len(shards)).tolist()
+        pool.map(_adlda_sweep, [(doc_start, doc_end, rng_seed, self.alpha, self.eta) 
+                                for (doc_start, doc_end), rng_seed in zip(shards, seeds)])
+        self.beta_counts[...] = self._beta_accum
+        self.topic_counts[...] = self._topic_accum
+
+
+    def _start_block_workers(self):
+        """Moves the sampler state to shared memory, partitions the corpus 
+        into n_workers x n_workers blocks of documents x words, and starts 
+        the worker pool. The blocks are precomputed as corpora of their own 
+        (word instance indices, word ids, document offsets, and documents), 
+        which takes O(n_workers^2 num_docs + num_corpus_words) memory shared 
+        with the forked workers. The number of word instances of the blocks 
+        is kept in self.block_tokens (rows are document groups, columns word 
+        groups) and the relative cost of a sweep (see balance_diagonals) in 
+        self.block_imbalance. 
+        """
+        
+        num_parts = self.n_workers 
+        word_freqs = bincount(self.word_ids, minlength=self.vocab_size)
+        doc_parts, word_parts = partition_blocks(self.doc_lengths, word_freqs, 
+                                                 num_parts)
+        block_ids = (doc_parts[self.doc_ids].astype(int64) * num_parts 
+                     + word_parts[self.word_ids])
+        block_tokens = bincount(block_ids, minlength=num_parts ** 2)
+        labels, self.block_imbalance = balance_diagonals(
+            block_tokens.reshape(num_parts, num_parts), 
+            random_seed=self.random_seed)
+        
+        # the word instances of a block, sorted by document 
+        
+        word_parts = labels[word_parts]
+        block_ids = (doc_parts[self.doc_ids].astype(int64) * num_parts 
+                     + word_parts[self.word_ids])
+        order = argsort(block_ids, kind='mergesort')
+        block_tokens = bincount(block_ids, minlength=num_parts ** 2)
+        bounds = hstack([[0], cumsum(block_tokens)]).tolist()
+        blocks = {}
+        for b in xrange(num_parts ** 2): 
+            token_ids = order[bounds[b]:bounds[b + 1]]
+            doc_ids = self.doc_ids[token_ids]
+            doc_offsets = zeros(self.num_docs + 1, dtype=int64)
+            cumsum(bincount(doc_ids, minlength=self.num_docs), out=doc_offsets[1:])
+            blocks[(b // num_parts, b % num_parts)] = (
+                token_ids, self.word_ids[token_ids], doc_offsets, 
+                unique(doc_ids).tolist())
+        self.block_tokens = block_tokens.reshape(num_parts, num_parts)
+        
+        shared = {}
+        for name in ('beta_counts', 'topic_counts', 'theta_counts', 'z'):
+            shared[name] = _to_shared(getattr(self, name))
+            setattr(self, name, _shared_view(*shared[name]))
+        
+        pool = Pool(processes=num_parts, initializer=_init_block_worker, 
+                    initargs=(self, shared, blocks))
+        
+        return pool, self.block_tokens 
+
+
+    def _sweep_blocks(self, pool, block_tokens):
+        """Runs one sweep of the block-diagonal parallel sampler: n_workers 
+        rounds of parallel block sweeps, after each of which the topic 
+        count changes of the workers are added to the global topic counts. 
+        The seeds of the blocks are drawn from the sampler's random number 
+        generator (n_workers per round, also for empty blocks), which makes 
+        a run reproducible. 
+        """
+        
+        num_parts = self.n_workers 
+        for l in xrange(num_parts): 
+            seeds = self.rng.randint(iinfo(int32).max, size=num_parts).tolist()
+            tasks = [((p, (p + l) % num_parts), seeds[p], self.alpha, self.eta) 
+                     for p in xrange(num_parts) 
+                     if block_tokens[p, (p + l) % num_parts]]
+            for topic_delta in pool.map(_block_sweep, tasks): 
+                self.topic_counts += topic_delta 
+
+
+    def _stop_workers(self, pool):
+        """Stops the worker pool and moves the sampler state back from the 
+        shared memory to ordinary arrays. 
+        """
+        
+        pool.close()
+        pool.join()
+        for name in ('beta_counts', 'topic_counts', 'theta_counts', 'z'):
+            setattr(self, name, getattr(self, name).copy())
+        if self.parallel == 'adlda': 
+            del self._beta_accum, self._topic_accum
+
+
+    def _sweep_standard(self, docs):
+        """Runs one collapsed Gibbs sweep over the word instances of the 
+        given documents, evaluating all the num_topics terms of the full 
+        conditional for every word instance. 
+        """
+        
+        # Identifying the constants for the iterations 
+        # This is to speed up 
+        doc_denom = (array(self.doc_lengths) - 1. + self.alpha.sum()) # a constant for k
+        vocab_size_x_eta = self.vocab_size * self.eta
+        implicit_alpha = self.implicit_alpha.tolist()
+        implicit_eta = self.implicit_eta
+        uniforms, pos = [], 0 # pre-drawn uniforms, one per word instance 
+        block_size = min(UNIFORM_BLOCK, self.num_corpus_words)
+        
+        for did in docs: # for each document 
+            start, end = self.doc_offsets[did], self.doc_offsets[did + 1]
+            doc_z = self.z[start:end].tolist()
+            doc_word_ids = self.word_ids[start:end].tolist()
+            if pos + end - start > len(uniforms): # draws the next block of uniforms 
+                uniforms = self.rng.random_sample(max(end - start, block_size)).tolist()
+                pos = 0
+            for j in xrange(end - start): # for each word instance 
+                wid = doc_word_ids[j] # word index 
+                tid = doc_z[j] # current topic 
+                
+                
+                # decrements the counts by 1
+                
+                self.beta_counts.itemset((tid, wid), self.beta_counts.item(tid, wid) - 1)
+                self.theta_counts.itemset((tid, did), self.theta_counts.item(tid, did) - 1)
+                self.topic_counts.itemset(tid, self.topic_counts.item(tid) - 1)
+                
+                # computes pvals 
+
+                # pvals = zeros(self.num_topics) # multinomial prob. vector 
+                # Note: I found that using numpy data strutures slows down 
+                #       execution. That's why the below lines are commented 
+                #       and followed a pure python approach (See below). 
+                #       The analysis is performed based on the python package 
+                #       cProfile, pstats, etc. 
+                # pvals = zeros(self.num_topics)              
+                # for k in xrange(self.num_topics):
+                #     pvals[k] = ((self.theta_counts[k, did] / doc_denom[did]) 
+                #                 * (self.beta_counts[k, wid]  
+                #                   / (self.topic_counts[k] + vocab_size_x_eta)))
+
+                pvals = []                
+                pvals_sum = 0.
+                for k in xrange(self.num_topics):
+                    pval = (((self.theta_counts.item(k, did) + implicit_alpha[k]) 
+                             / doc_denom[did]) 
+                            * ((self.beta_counts.item(k, wid) + implicit_eta) 
+                              / (self.topic_counts.item(k) + vocab_size_x_eta)))
+                    pvals.append(pval)
+                    pvals_sum += pval
+
+                # Multinomial sampling 
+
+                # Note: multinomial requires the vector pvals to sums to 1. 
+                #       If we are using draw_multinomial it's not required.
+                #       In addition, we found that the numpy multinomial 
+                #       is slower than draw_multinomial   
+                # tid =  multinomial(1, pvals/pvals_sum, size=1).argmax()  
+                tid = self.draw_multinomial(pvals, pvals_sum, uniforms[pos + j])
+                
+                # increments the counts by 1 
+
+                self.beta_counts.itemset((tid, wid), self.beta_counts.item(tid, wid) + 1)
+                self.theta_counts.itemset((tid, did), self.theta_counts.item(tid, did) + 1)
+                self.topic_counts.itemset(tid, self.topic_counts.item(tid) + 1)
+                doc_z[j] = tid
+            self.z[start:end] = doc_z
+            pos += end - start
+
+
+    def _sweep_sparse(self, docs):
+        """Runs one collapsed Gibbs sweep using the SparseLDA bucketing 
+        (Yao, Mimno, and McCallum, 2009). 
+        
+        The unnormalized full conditional of topic k for word w in document d 
+        
+            (alpha_k + n_kd) (eta + n_kw) / (V eta + n_k)
+        
+        is split into three buckets  
+        
+            s = alpha_k eta / (V eta + n_k)             (smoothing, all k)
+            r = n_kd eta / (V eta + n_k)                (k with n_kd > 0)
+            q = (alpha_k + n_kd) n_kw / (V eta + n_k)   (k with n_kw > 0)
+        
+        The bucket masses s and r are updated incrementally as the counts 
+        change, and the coefficient (alpha_k + n_kd) / (V eta + n_k) of q is 
+        cached for all k. So, the cost per word instance is proportional to 
+        the number of nonzero topics in the document and word rather than 
+        num_topics. The setup cost of a sweep is proportional to the unique 
+        words of the given documents, not to the vocabulary. 
+        """
+        
+        docs = list(docs)
+        if not docs: 
+            return 
+        alpha = self.alpha.tolist()
+        eta = self.eta
+        alpha_x_eta = [alpha_k * eta for alpha_k in alpha]
+        vocab_size_x_eta = self.vocab_size * eta
+        num_topics = self.num_topics
+        
+        # The sparse topic-word counts {word: {topic: n_kw}} of the words of 
+        # the documents are built from the global beta counts (read in bulk), 
+        # so this also works when the sweep covers only a subset of 
+        # documents 
+        
+        offsets = self.doc_offsets 
+        sweep_wids = unique(hstack([self.word_ids[offsets[did]:offsets[did + 1]] 
+                                    for did in docs]))
+        word_topics = dict((w, {}) for w in sweep_wids.tolist())
+        folded_eta = eta - self.implicit_eta # eta included in beta_counts 
+        word_counts = self.beta_counts[:, sweep_wids] - folded_eta 
+        tids, cols = (word_counts > .5).nonzero()
+        for k, w, n_kw in zip(tids.tolist(), sweep_wids[cols].tolist(), 
+                              rint(word_counts[tids, cols]).astype(int64).tolist()):
+            word_topics[w][k] = n_kw 
+        
+        denoms = [float(n_k) + vocab_size_x_eta for n_k in self.topic_counts]
+        s_sum = sum(a_x_e / den for a_x_e, den in zip(alpha_x_eta, denoms)) # smoothing bucket 
+        coefs = [alpha_k / den for alpha_k, den in zip(alpha, denoms)] # q bucket coefficients 
+        folded_alpha = self.alpha - self.implicit_alpha # alpha included in theta_counts 
+        uniforms, pos = [], 0 # pre-drawn uniforms, one per word instance 
+        block_size = min(UNIFORM_BLOCK, self.num_corpus_words)
+        
+        for did in docs: # for each document 
+            start, end = self.doc_offsets[did], self.doc_offsets[did + 1]
+            doc_z = self.z[start:end].tolist()
+            doc_word_ids = self.word_ids[start:end].tolist()
+            if pos + end - start > len(uniforms): # draws the next block of uniforms 
+                uniforms = self.rng.random_sample(max(end - start, block_size)).tolist()
+                pos = 0
+            
+            # the sparse document-topic counts {topic: n_kd}, read from the 
+            # theta counts, because the word instances of the sweep can be 
+            # a part of the document (see _block_sweep). The topics of 
+            # doc_z are inserted first, in the order of their first use. 
+            
+            doc_topics = dict.fromkeys(doc_z, 0)
+            doc_counts = self.theta_counts[:, did] - folded_alpha 
+            for k in (doc_counts > .5).nonzero()[0].tolist():
+                doc_topics[k] = int(round(doc_counts[k]))
+            r_sum = 0. # document bucket 
+            for k, n_kd in doc_topics.iteritems():
+                r_sum += eta * n_kd / denoms[k]
+                coefs[k] = (alpha[k] + n_kd) / denoms[k]
+            
+            for j in xrange(end - start): # for each word instance 
+                wid = doc_word_ids[j] # word index 
+                tid = doc_z[j] # current topic 
+                w_topics = word_topics[wid]
+                
+                # decrements the counts by 1
+                
+                self.beta_counts.itemset((tid, wid), self.beta_counts.item(tid, wid) - 1)
+                self.theta_counts.itemset((tid, did), self.theta_counts.item(tid, did) - 1)
+                self.topic_counts.itemset(tid, self.topic_counts.item(tid) - 1)
+                
+                n_kd = doc_topics[tid]
+                den = denoms[tid]
+                s_sum -= alpha_x_eta[tid] / den
+                r_sum -= eta * n_kd / den
+                n_kd -= 1
+                den -= 1.
+                s_sum += alpha_x_eta[tid] / den
+                r_sum += eta * n_kd / den
+                coefs[tid] = (alpha[tid] + n_kd) / den
+                denoms[tid] = den
+                if n_kd: 
+                    doc_topics[tid] = n_kd
+                else:
+                    del doc_topics[tid]
+                if w_topics[tid] == 1: 
+                    del w_topics[tid]
+                else:
+                    w_topics[tid] -= 1
+                
+                # computes the topic-word bucket 
+                
+                q_vals = []
+                q_sum = 0.
+                for k, n_kw in w_topics.iteritems():
+                    q_val = coefs[k] * n_kw
+                    q_vals.append((k, q_val))
+                    q_sum += q_val
+                
+                # samples a bucket and then a topic within the bucket 
+                
+                u = uniforms[pos + j] * (s_sum + r_sum + q_sum)
+                if u < q_sum: 
+                    for tid, q_val in q_vals: 
+                        u -= q_val
+                        if u <= 0.: break 
+                elif u < q_sum + r_sum:
+                    u -= q_sum
+                    for tid, n_kd in doc_topics.iteritems():
+                        u -= eta * n_kd / denoms[tid]
+                        if u <= 0.: break 
+                else:
+                    u -= q_sum + r_sum
+                    for tid in xrange(num_topics):
+                        u -= alpha_x_eta[tid] / denoms[tid]
+                        if u <= 0.: break 
+                
+                # increments the counts by 1 
+                
+                self.beta_counts.itemset((tid, wid), self.beta_counts.item(tid, wid) + 1)
+                self.theta_counts.itemset((tid, did), self.theta_counts.item(tid, did) + 1)
+                self.topic_counts.itemset(tid, self.topic_counts.item(tid) + 1)
+                doc_z[j] = tid
+                
+                n_kd = doc_topics.get(tid, 0)
+                den = denoms[tid]
+                s_sum -= alpha_x_eta[tid] / den
+                r_sum -= eta * n_kd / den
+                n_kd += 1
+                den += 1.
+                s_sum += alpha_x_eta[tid] / den
+                r_sum += eta * n_kd / den
+                coefs[tid] = (alpha[tid] + n_kd) / den
+                denoms[tid] = den
+                doc_topics[tid] = n_kd
+                w_topics[tid] = w_topics.get(tid, 0) + 1
+            self.z[start:end] = doc_z
+            pos += end - start
+            
+            # resets the q bucket coefficients of the document's topics 
+            
+            for k in doc_topics: 
+                coefs[k] = alpha[k] / denoms[k]
+
+
+    def _alias_dtype(self):
+        """Returns the data type of the aliases of the alias tables"""
+        
+        return dtype(int16 if self.num_topics <= iinfo(int16).max + 1 else int32)
+
+
+    def _new_alias_tables(self):
+        """Allocates the alias tables of the 'alias' mode: V x K float32 
+        buffers of the probabilities and of the weights a table was built 
+        from, a V x K buffer of the aliases (int16 for up to 32768 topics), 
+        and the number of draws left of every word's table (0 for a table 
+        that is not built or must be rebuilt). The zero-filled buffers take 
+        physical memory only for the rows of the words in use. 
+        """
+        
+        shape = (self.vocab_size, self.num_topics)
+        return {'probs': zeros(shape, dtype=float32), 
+                'aliases': zeros(shape, dtype=self._alias_dtype()), 
+                'weights': zeros(shape, dtype=float32), 
+                'draws': zeros(self.vocab_size, dtype=int32)}
+
+
+    def _sweep_alias(self, docs):
+        """Runs one Metropolis-Hastings sweep as in LightLDA (Yuan et al., 
+        2015), alternating between a word proposal and a document proposal 
+        for every word instance. 
+        
+        The word proposal is (n_kw + eta) / (n_k + V eta), drawn in O(1) 
+        from a per-word alias table. The tables are built from beta_counts 
+        on first use and rebuilt once they served alias_refresh draws, so 
+        the O(num_topics) construction cost is amortized. The acceptance 
+        ratio uses the (stale) weights the table was built from. As a stale 
+        table depends on the past states of the chain rather than on the 
+        current state only, the chain is not exactly stationary at the 
+        posterior: stale tables trade a small bias for speed (e.g., a max 
+        marginal error of 0.026 vs 0.006 for tables rebuilt on every draw, 
+        in an exact enumeration of a 9-word instance corpus with K = 3). 
+        With alias_refresh = 1, each step is an exact Metropolis-Hastings 
+        step. 
+        
+        The tables are kept in compact numpy buffers (see _new_alias_tables), 
+        and the rows of a document's words are converted to Python lists 
+        only while the document is swept. 
+        
+        The document proposal is (n_kd + alpha_k), drawn in O(1) by picking 
+        the topic of another word instance in the document or a topic from 
+        the alias table of alpha (uniform for a symmetric alpha). 
+        """
+        
+        vocab_size_x_eta = self.vocab_size * self.eta
+        num_topics = self.num_topics
+        alpha_sum = self.alpha.sum()
+        alpha_probs, alpha_aliases = build_alias_table(self.alpha.tolist())
+        beta_counts = self.beta_counts
+        theta_counts = self.theta_counts
+        topic_counts = self.topic_counts
+        implicit_alpha = self.implicit_alpha.tolist()
+        implicit_eta = self.implicit_eta
+        if self.alias_tables is None: 
+            self.alias_tables = self._new_alias_tables()
+        table_probs = self.alias_tables['probs']
+        table_aliases = self.alias_tables['aliases']
+        table_weights = self.alias_tables['weights']
+        table_draws = self.alias_tables['draws']
+        alias_refresh = self.alias_refresh 
+        
+        # pre-drawn uniforms, at most 5 per Metropolis-Hastings cycle 
+        uniforms, ui = [], 0 
+        max_uniforms = 5 * self.mh_steps 
+        block_size = min(UNIFORM_BLOCK, max_uniforms * self.num_corpus_words)
+        
+        for did in docs: # for each document 
+            start, end = self.doc_offsets[did], self.doc_offsets[did + 1]
+            doc_z = self.z[start:end].tolist()
+            doc_word_ids = self.word_ids[start:end].tolist()
+            doc_length = end - start
+            if ui + max_uniforms * doc_length > len(uniforms): # draws the next block 
+                uniforms = self.rng.random_sample(max(max_uniforms * doc_length, 
+                                                      block_size)).tolist()
+                ui = 0
+            
+            # the alias tables of the document's words as lists [probs, 
+            # aliases, weights, draws left], converted on first use 
+            tables = {}
+            
+            # probability of proposing the topic of another word instance 
+            doc_draw_prob = ((doc_length - 1.) 
+                             / (doc_length - 1. + alpha_sum))
+            
+            for pos in xrange(doc_length): # for each word instance 
+                wid = doc_word_ids[pos] # word index 
+                tid = doc_z[pos] # current topic 
+                
+                # decrements the counts by 1
+                
+                beta_counts.itemset((tid, wid), beta_counts.item(tid, wid) - 1)
+                theta_counts.itemset((tid, did), theta_counts.item(tid, did) - 1)
+                topic_counts.itemset(tid, topic_counts.item(tid) - 1)
+                
+                for _ in xrange(self.mh_steps):
+                    
+                    # word proposal 
+                    
+                    table = tables.get(wid)
+                    if table is None: 
+                        table = [None, None, None, table_draws.item(wid)]
+                        if table[3] > 0: 
+                            table[:3] = (table_probs[wid].tolist(), 
+                                         table_aliases[wid].tolist(), 
+                                         table_weights[wid].tolist())
+                        tables[wid] = table 
+                    if table[3] <= 0: # (re)builds the table 
+                        weights = ((beta_counts[:, wid] + implicit_eta)
+                                   / (topic_counts + vocab_size_x_eta))
+                        probs, aliases = build_alias_table(weights.tolist())
+                        table_probs[wid] = probs 
+                        table_aliases[wid] = aliases 
+                        table_weights[wid] = weights 
+                        table[:] = (table_probs[wid].tolist(), aliases, 
+                                    table_weights[wid].tolist(), alias_refresh)
+                    probs, aliases, weights, _ = table
+                    table[3] -= 1
+                    
+                    u = uniforms[ui] * num_topics
+                    ui += 1
+                    new_tid = int(u)
+                    if u - new_tid >= probs[new_tid]: 
+                        new_tid = aliases[new_tid]
+                    
+                    if new_tid != tid: 
+                        ratio = (((theta_counts.item(new_tid, did) + implicit_alpha[new_tid]) 
+                                  * (beta_counts.item(new_tid, wid) + implicit_eta) 
+                                  * (topic_counts.item(tid) + vocab_size_x_eta) 
+                                  * weights[tid]) 
+                                 / ((theta_counts.item(tid, did) + implicit_alpha[tid]) 
+                                    * (beta_counts.item(tid, wid) + implicit_eta) 
+                                    * (topic_counts.item(new_tid) + vocab_size_x_eta) 
+                                    * weights[new_tid]))
+                        if ratio >= 1.: 
+                            tid = new_tid
+                        else: 
+                            if uniforms[ui] < ratio: 
+                                tid = new_tid
+                            ui += 1
+                    
+                    # document proposal: the theta counts cancel out 
+                    
+                    if uniforms[ui] < doc_draw_prob: 
+                        j = int(uniforms[ui + 1] * (doc_length - 1))
+                        if j >= pos: j += 1 # skips the current word instance 
+                        new_tid = doc_z[j]
+                    else:
+                        u = uniforms[ui + 1] * num_topics
+                        new_tid = int(u)
+                        if u - new_tid >= alpha_probs[new_tid]: 
+                            new_tid = alpha_aliases[new_tid]
+                    
+                    ui += 2
+                    
+                    if new_tid != tid: 
+                        ratio = (((beta_counts.item(new_tid, wid) + implicit_eta) 
+                                  * (topic_counts.item(tid) + vocab_size_x_eta)) 
+                                 / ((beta_counts.item(tid, wid) + implicit_eta) 
+                                    * (topic_counts.item(new_tid) + vocab_size_x_eta)))
+                        if ratio >= 1.: 
+                            tid = new_tid
+                        else: 
+                            if uniforms[ui] < ratio: 
+                                tid = new_tid
+                            ui += 1
+                
+                # increments the counts by 1 
+                
+                beta_counts.itemset((tid, wid), beta_counts.item(tid, wid) + 1)
+                theta_counts.itemset((tid, did), theta_counts.item(tid, did) + 1)
+                topic_counts.itemset(tid, topic_counts.item(tid) + 1)
+                doc_z[pos] = tid
+            self.z[start:end] = doc_z
+            for wid, table in tables.iteritems(): 
+                table_draws.itemset(wid, table[3])
+
+
+    def _sweep_vectorized(self, docs):
+        """Runs one collapsed Gibbs sweep, computing the full conditional of 
+        every word instance with NumPy row operations. 
+        
+        For each document, the theta counts of the document and the beta 
+        counts of its unique words are copied once into contiguous vectors 
+        (the rows of the unique words' counts), the word instances are 
+        sampled against those local copies using cumsum and searchsorted, 
+        and the copies are written back at the end of the document. The 
+        reciprocals of the topic count denominators are cached and updated 
+        only for the two topics that change. 
+        """
+        
+        vocab_size_x_eta = self.vocab_size * self.eta
+        topic_counts = self.topic_counts
+        inv_denoms = 1. / (topic_counts + vocab_size_x_eta)
+        pvals = zeros(self.num_topics)
+        cdf = zeros(self.num_topics)
+        max_tid = self.num_topics - 1
+        uniforms, pos = [], 0 # pre-drawn uniforms, one per word instance 
+        block_size = min(UNIFORM_BLOCK, self.num_corpus_words)
+        
+        for did in docs: # for each document 
+            start, end = self.doc_offsets[did], self.doc_offsets[did + 1]
+            if start == end: continue 
+            uwids, rows = unique(self.word_ids[start:end], return_inverse=True)
+            rows = rows.tolist()
+            doc_z = self.z[start:end].tolist()
+            # local copies of the counts (unique words x K), including priors 
+            word_counts = array(self.beta_counts[:, uwids].T, dtype=float64, order='C')
+            word_counts += self.implicit_eta
+            doc_counts = self.theta_counts[:, did].astype(float64)
+            doc_counts += self.implicit_alpha
+            if pos + end - start > len(uniforms): # draws the next block of uniforms 
+                uniforms = self.rng.random_sample(max(end - start, block_size)).tolist()
+                pos = 0
+            
+            for j in xrange(end - start): # for each word instance 
+                word_row = word_counts[rows[j]]
+                tid = doc_z[j] # current topic 
+                
+                # decrements the counts by 1
+                
+                word_row[tid] -= 1. 
+                doc_counts[tid] -= 1. 
+                topic_counts.itemset(tid, topic_counts.item(tid) - 1)
+                inv_denoms[tid] = 1. / (topic_counts.item(tid) + vocab_size_x_eta)
+                
+                # computes pvals and samples from the unnormalized cdf 
+                
+                multiply(doc_counts, word_row, out=pvals)
+                pvals *= inv_denoms
+                cumsum(pvals, out=cdf)
+                tid = min(cdf.searchsorted(uniforms[pos + j] * cdf[-1]), max_tid)
+                
+                # increments the counts by 1 
+                
+                word_row[tid] += 1.
+                doc_counts[tid] += 1.
+                topic_counts.itemset(tid, topic_counts.item(tid) + 1)
+                inv_denoms[tid] = 1. / (topic_counts.item(tid) + vocab_size_x_eta)
+                doc_z[j] = tid
+            
+            if self.compact_state: # back to integer counts 
+                word_counts -= self.implicit_eta
+                doc_counts -= self.implicit_alpha
+                rint(word_counts, out=word_counts)
+                rint(doc_counts, out=doc_counts)
+            self.beta_counts[:, uwids] = word_counts.T
+            self.theta_counts[:, did] = doc_counts
+            self.z[start:end] = doc_z
+            pos += end - start
+
+
+
+###############################################################################
+# Multiple chains and convergence diagnostics 
+###############################################################################
+
+def gelman_rubin(traces):
+    """Computes the Gelman-Rubin potential scale reduction factor (R-hat) 
+    of a scalar quantity. 
+    
+    Parameters
+    
+    traces      : m x n array, the n draws of each of the m chains 
+    
+    """
+    
+    traces = array(traces, dtype=float)
+    num_chains, n = traces.shape
+    assert(num_chains > 1 and n > 1)
+    
+    within_var = traces.var(axis=1, ddof=1).mean() # W 
+    between_var = n * traces.mean(axis=1).var(ddof=1) # B 
+    if within_var == 0.: 
+        return 1. if between_var == 0. else inf
+    var_plus = (n - 1.) / n * within_var + between_var / n 
+    
+    return sqrt(var_plus / within_var)
+
+
+def effective_sample_size(traces):
+    """Computes the effective sample size of a scalar quantity from multiple 
+    chains (Gelman et al., Bayesian Data Analysis, 3rd ed., Sec. 11.5), 
+    summing the autocorrelation estimates until the sum of two consecutive 
+    ones becomes negative. 
+    
+    Parameters
+    
+    traces      : m x n array, the n draws of each of the m chains 
+    
+    """
+    
+    traces = array(traces, dtype=float)
+    num_chains, n = traces.shape
+    assert(n > 1)
+    
+    within_var = traces.var(axis=1, ddof=1).mean()
+    var_plus = (n - 1.) / n * within_var
+    if num_chains > 1: 
+        var_plus += traces.mean(axis=1).var(ddof=1)
+    if var_plus == 0.: 
+        return float(num_chains * n)
+    
+    rho_sum = 0. 
+    t = 1
+    while t + 1 < n: 
+        rho_pair = 0.
+        for lag in (t, t + 1):
+            variogram = ((traces[:, lag:] - traces[:, :-lag]) ** 2).mean()
+            rho_pair += 1. - variogram / (2. * var_plus)
+        if rho_pair < 0.: 
+            break 
+        rho_sum += rho_pair
+        t += 2
+    
+    return num_chains * n / (1. + 2. * rho_sum)
+
+
+def _run_chain(sampler, random_seed, message_interval, conn):
+    """Runs a single chain of run_chains in a child process. The chain 
+    waits for the iteration to run until, runs the Gibbs iterations, and 
+    sends back the log-likelihoods and the sorted topic counts after every 
+    iteration. A None message stops the chain, which then sends back the 
+    fitted sampler. 
+    """
+    
+    sampler.random_seed = random_seed
+    if sampler.sample_dir is not None: 
+        sampler.sample_dir = join(sampler.sample_dir, 'chain-%d' % random_seed)
+    sampler.initialize_state()
+    while True: 
+        stop = conn.recv()
+        if stop is None: 
+            break 
+        lls, topic_counts = [], []
+        while sampler.iteration < stop: 
+            sampler._run_iterations(message_interval, sampler.iteration + 1)
+            lls.append(sampler.log_likelihood())
+            topic_counts.append(sort(sampler.topic_counts)[::-1])
+        conn.send((lls, topic_counts))
+    sampler._close_sample_sink()
+    sampler._finalize_estimates()
+    conn.send(sampler)
+    conn.close()
+
+
+def run_chains(sampler, num_chains, random_seeds=None, check_interval=50, 
+               rhat_threshold=1.1, message_interval=100):
+    """Runs independent chains of the (unfitted) sampler in parallel processes 
+    and stops them once they have converged. 
+    
+    Every check_interval iterations (after the burn in period), the 
+    Gelman-Rubin R-hat and the effective sample size are computed on the 
+    second half of the traces of the joint log-likelihood and of the sorted 
+    topic counts (which do not depend on the topic labeling). The chains are 
+    stopped once the largest R-hat falls below rhat_threshold, or after 
+    max_iter iterations. The word instance arrays are moved to shared 
+    memory, so the chains share a single read-only copy of them. 
+    
+    Parameters
+    
+    sampler         : an AugmentedCollapsedGibbsSampler that defines the 
+                      corpus, the model, and the run (n_workers must be 1) 
+    num_chains      : the number of chains (> 1) 
+    random_seeds    : the seeds of the chains, by default random_seed, 
+                      random_seed + 1, ... 
+    check_interval  : the number of iterations between convergence checks 
+    rhat_threshold  : the R-hat value below which the chains are considered 
+                      to have converged 
+    message_interval: the message interval of each chain 
+    
+    Returns a tuple (chains, diagnostics), the fitted samplers of the chains 
+    and a dict with the traces ('log_likelihoods', num_chains x iterations; 
+    'topic_counts', num_chains x iterations x num_topics), the history of 
+    the checks ('checks', a list of (iteration, max R-hat, R-hat of the 
+    log-likelihood, ESS of the log-likelihood)), and whether the chains 
+    'converged'. If the sampler has a sample_dir, the samples of each chain 
+    are stored in its subdirectory chain-<random seed>. 
+    
+    """
+    
+    assert(num_chains > 1)
+    assert(sampler.n_workers == 1)
+    assert(check_interval > 1)
+    if random_seeds is None: 
+        random_seeds = [sampler.random_seed + c for c in xrange(num_chains)]
+    assert(len(set(random_seeds)) == num_chains)
+    
+    for name in ('word_ids', 'doc_ids', 'doc_lengths', 'doc_offsets'):
+        setattr(sampler, name, _shared_view(*_to_shared(getattr(sampler, name))))
+    
+    conns, processes = [], []
+    for random_seed in random_seeds: 
+        parent_conn, child_conn = Pipe()
+        process = Process(target=_run_chain, 
+                          args=(sampler, random_seed, message_interval, 
+                                child_conn))
+        process.daemon = True
+        process.start()
+        conns.append(parent_conn)
+        processes.append(process)
+    
+    lls = [[] for _ in xrange(num_chains)]
+    topic_counts = [[] for _ in xrange(num_chains)]
+    checks = []
+    converged = False 
+    iteration = 0
+    
+    try: 
+        while iteration < sampler.max_iter and not converged: 
+            if iteration < sampler.burn_in_iter: 
+                iteration = min(sampler.burn_in_iter + check_interval, 
+                                sampler.max_iter)
+            else: 
+                iteration = min(iteration + check_interval, sampler.max_iter)
+            for conn in conns: 
+                conn.send(iteration)
+            for c, conn in enumerate(conns): 
+                chain_lls, chain_topic_counts = conn.recv()
+                lls[c].extend(chain_lls)
+                topic_counts[c].extend(chain_topic_counts)
+            
+            # diagnostics on the second half of the traces 
+            
+            half = iteration // 2 
+            ll_traces = array(lls)[:, half:]
+            count_traces = array(topic_counts)[:, half:, :]
+            ll_rhat = gelman_rubin(ll_traces)
+            rhats = [ll_rhat] + [gelman_rubin(count_traces[:, :, k]) 
+                                 for k in xrange(sampler.num_topics)]
+            max_rhat = max(rhats)
+            checks.append((iteration, max_rhat, ll_rhat, 
+                           effective_sample_size(ll_traces)))
+            converged = max_rhat < rhat_threshold 
+        
+        for conn in conns: 
+            conn.send(None)
+        chains = [conn.recv() for conn in conns]
+    finally: 
+        for process in processes: 
+            process.join(1.)
+            if process.is_alive(): 
+                process.terminate()
+    
+    diagnostics = {'log_likelihoods': array(lls), 
+                   'topic_counts': array(topic_counts), 
+                   'checks': checks, 
+                   'converged': converged}
+    
+    return chains, diagnostics
+
+
+
+###############################################################################
+# Fold-in inference for new documents 
+###############################################################################
+
+def _iter_batches(corpus, batch_size):
+    batch = []
+    for doc in corpus: 
+        batch.append(doc)
+        if len(batch) == batch_size: 
+            yield batch 
+            batch = []
+    if batch: 
+        yield batch 
+
+
+def fold_in(docs, word_topic, alpha, num_sweeps, method, rng, 
+            return_word_topic=False):
+    """Infers the topic proportions of a batch of documents given the frozen 
+    topic-word probabilities, updating all the documents at once. 
+    
+    The documents are sorted by length, so that the documents that have a 
+    j-th word (instance) are the first ones. A sweep visits the j-th words 
+    of all the documents together, for j = 0, 1, ... The first sweep 
+    initializes the assignments sequentially from the conditionals. 
+    
+    Arguments: 
+        docs - a list of documents in the bag-of-words format 
+        word_topic - V x K matrix, the topic probabilities of each word 
+        alpha - the Dirichlet prior of theta, a scalar or K values 
+        num_sweeps - the number of sweeps 
+        method - 'gibbs' or 'cvb0' (see AugmentedCollapsedGibbsSampler.transform) 
+        rng - a numpy RandomState 
+        return_word_topic - if True, the topic-word counts of the documents 
+                            are returned too 
+    
+    Returns a K x len(docs) matrix, the topic proportions of the documents, 
+    and, if return_word_topic, a K x V matrix, the (expected) topic-word 
+    counts n_kw of the documents, i.e., the counts averaged over the same 
+    sweeps as theta for Gibbs, or the sums of the responsibilities for CVB0. 
+    """
+    
+    vocab_size, num_topics = word_topic.shape
+    num_docs = len(docs)
+    alpha = array(alpha, dtype=float64) * ones(num_topics)
+    
+    # the word ids (word instances for Gibbs, unique words for CVB0) and 
+    # the word counts of the documents, padded to the longest document 
+    
+    bows = [[(int(word_id), float(word_count)) for word_id, word_count in doc 
+             if 0 <= word_id < vocab_size and word_count > 0] for doc in docs]
+    if method == 'gibbs': 
+        doc_words = [repeat([w for w, _ in bow], [int(c) for _, c in bow]).astype(int64) 
+                     for bow in bows]
+    else: 
+        doc_words = [array([w for w, _ in bow], dtype=int64) for bow in bows]
+    lengths = array([len(words) for words in doc_words], dtype=int64)
+    order = argsort(-lengths, kind='mergesort')
+    max_length = lengths.max() if num_docs else 0
+    words = zeros((num_docs, max_length), dtype=int64)
+    word_counts = zeros((num_docs, max_length))
+    doc_lengths = zeros(num_docs)
+    for row, d in enumerate(order): 
+        words[row, :lengths[d]] = doc_words[d]
+        if method == 'gibbs': 
+            word_counts[row, :lengths[d]] = 1.
+        else: 
+            word_counts[row, :lengths[d]] = [c for _, c in bows[d]]
+        doc_lengths[row] = word_counts[row].sum()
+    
+    # the number of documents that have a j-th word 
+    num_active = (lengths[order][newaxis, :] > arange(max_length)[:, newaxis]).sum(axis=1)
+    
+    doc_topic = zeros((num_docs, num_topics)) # expected counts n_kd 
+    theta_sum = zeros((num_docs, num_topics))
+    if return_word_topic: 
+        valid = (arange(max_length)[newaxis, :] < lengths[order][:, newaxis]) 
+        valid_words = words[valid]
+        word_topic_sum = zeros(num_topics * vocab_size)
+    num_estimates = 0 
+    if method == 'gibbs': 
+        z = zeros((num_docs, max_length), dtype=int64)
+    else: 
+        resps = zeros((num_docs, max_length, num_topics), dtype=float32)
+    
+    for sweep in xrange(num_sweeps): 
+        for j in xrange(max_length): 
+            n = num_active[j]
+            rows = arange(n)
+            counts = word_counts[:n, j]
+            
+            if sweep > 0: # removes the current assignments 
+                if method == 'gibbs': 
+                    doc_topic[rows, z[:n, j]] -= 1.
+                else: 
+                    doc_topic[:n] -= counts[:, newaxis] * resps[:n, j]
+            
+            pvals = doc_topic[:n] + alpha 
+            pvals *= word_topic[words[:n, j]]
+            
+            if method == 'gibbs': 
+                cdf = pvals.cumsum(axis=1)
+                u = rng.random_sample(n) * cdf[:, -1]
+                tids = (cdf < u[:, newaxis]).sum(axis=1)
+                tids[tids == num_topics] = num_topics - 1 # rounding errors 
+                z[:n, j] = tids 
+                doc_topic[rows, tids] += 1.
+            else: 
+                pvals /= pvals.sum(axis=1, keepdims=True)
+                resps[:n, j] = pvals 
+                doc_topic[:n] += counts[:, newaxis] * pvals 
+        
+        if method == 'gibbs' and sweep >= num_sweeps // 2: 
+            theta_sum += doc_topic 
+            num_estimates += 1
+            if return_word_topic: 
+                word_topic_sum += bincount(z[valid] * vocab_size + valid_words, 
+                                           minlength=num_topics * vocab_size)
+    
+    if method == 'gibbs': 
+        doc_topic = theta_sum / num_estimates
+    theta = zeros((num_topics, num_docs))
+    theta[:, order] = ((doc_topic + alpha) 
+                       / (doc_lengths + alpha.sum())[:, newaxis]).T
+    
+    if not return_word_topic: 
+        return theta 
+    
+    if method == 'gibbs': 
+        word_topic_counts = word_topic_sum.reshape(num_topics, vocab_size) / num_estimates
+    else: 
+        weights = resps[valid] * word_counts[valid][:, newaxis]
+        word_topic_counts = array([bincount(valid_words, weights=weights[:, k], 
+                                            minlength=vocab_size) 
+                                   for k in xrange(num_topics)])
+    
+    return theta, word_topic_counts 
+
+
+def fold_in_corpus(corpus, word_topic, alpha, num_sweeps, method, batch_size, 
+                   n_workers, random_seed):
+    """Folds in the documents of a corpus batch by batch (see fold_in), 
+    optionally in n_workers processes. The seeds of the batches are drawn 
+    from random_seed, so the result does not depend on n_workers. 
+    
+    Returns a K x number of documents matrix, the topic proportions of the 
+    documents. 
+    """
+    
+    batch_seeds = RandomState(random_seed)
+    tasks = ((batch, alpha, num_sweeps, method, 
+              batch_seeds.randint(iinfo(int32).max)) 
+             for batch in _iter_batches(corpus, batch_size))
+    
+    if n_workers > 1: 
+        pool = Pool(processes=n_workers, initializer=_init_fold_in_worker, 
+                    initargs=(_to_shared(word_topic),))
+        try: 
+            thetas = list(pool.imap(_fold_in_batch, tasks))
+        finally: 
+            pool.close()
+            pool.join()
+    else: 
+        thetas = [fold_in(batch, word_topic, alpha, num_sweeps, method, 
+                          RandomState(rng_seed)) 
+                  for batch, alpha, num_sweeps, method, rng_seed in tasks]
+    
+    if not thetas: # an empty corpus 
+        return zeros((word_topic.shape[1], 0))
+    
+    return hstack(thetas)
+
+
+# The per-process state of the fold-in workers (see _init_fold_in_worker) 
+_fold_in_worker = {}
+
+
+def _init_fold_in_worker(shared_word_topic):
+    _fold_in_worker['word_topic'] = _shared_view(*shared_word_topic)
+
+
+def _fold_in_batch(task):
+    docs, alpha, num_sweeps, method, rng_seed = task 
+    return fold_in(docs, _fold_in_worker['word_topic'], alpha, num_sweeps, 
+                   method, RandomState(rng_seed))
+
+
+
+###############################################################################
+# Stochastic (minibatch) collapsed Gibbs sampling 
+###############################################################################
+
+class StochasticCollapsedGibbsSampler(object):
+    """Fits LDA on a stream of documents, e.g., a corpus that does not fit 
+    in memory, with stochastic collapsed Gibbs sampling (or SCVB0, Foulds 
+    et al., 2013). 
+    
+    The documents are read in minibatches. The topic assignments of a 
+    minibatch are sampled (or, for CVB0, their responsibilities are 
+    updated) against the global topic-word statistics, as in fold_in, and 
+    the statistics are then moved towards the minibatch's topic-word counts 
+    scaled up to the corpus size 
+    
+        N_kw <- (1 - rho_t) N_kw + rho_t (corpus_size / batch size) n_kw 
+    
+    with the decaying step size rho_t = (tau0 + t)^(-kappa). The document 
+    level state is discarded after each minibatch, so the memory is bounded 
+    by the K x V statistics and a single minibatch. 
+    """
+    
+    def __init__(self, num_topics, vocab_size, alpha, eta, corpus_size, 
+                 batch_size=256, num_sweeps=5, method='gibbs', tau0=1., 
+                 kappa=.7, random_seed=1983):
+        """
+        Arguments: 
+            num_topics - the number of topics 
+            vocab_size - the vocabulary size 
+            alpha - the Dirichlet prior of theta, a scalar or num_topics 
+                    values 
+            eta - the symmetric Dirichlet prior of beta 
+            corpus_size - the (estimated) number of documents in the corpus 
+            batch_size - the number of documents of a minibatch 
+            num_sweeps - the number of sweeps over a minibatch 
+            method - 'gibbs' or 'cvb0' (see fold_in) 
+            tau0, kappa - the step size parameters, tau0 >= 0 and kappa in 
+                          (0.5, 1] 
+            random_seed - the seed of the random number generator 
+        """
+        
+        self.num_topics = num_topics
+        self.vocab_size = vocab_size
+        self.alpha = array(alpha, dtype=float64) * ones(num_topics)
+        self.eta = float(eta)
+        self.corpus_size = corpus_size
+        self.batch_size = batch_size
+        self.num_sweeps = num_sweeps
+        self.method = method
+        self.tau0 = tau0
+        self.kappa = kappa
+        self.random_seed = random_seed
+        
+        assert(self.num_topics > 1)
+        assert(self.vocab_size > 1)
+        assert(self.alpha.shape == (num_topics,) and (self.alpha > 0.).all())
+        assert(self.eta > 0.)
+        assert(self.corpus_size > 0)
+        assert(self.batch_size > 0 and self.num_sweeps > 0)
+        assert(self.method in ('gibbs', 'cvb0'))
+        assert(self.tau0 >= 0. and .5 < self.kappa <= 1.)
+        
+        self.initialize_state()
+    
+    def initialize_state(self):
+        """Initializes the topic-word statistics N_kw with random positive 
+        values, which break the symmetry between the topics 
+        """
+        
+        self.rng = RandomState(self.random_seed)
+        self.beta_counts = self.rng.gamma(100., 1. / 100., 
+                                          (self.num_topics, self.vocab_size))
+        self.topic_counts = self.beta_counts.sum(axis=1)
+        self.num_updates = 0
+        self.num_seen_docs = 0
+    
+    def word_topic(self):
+        """Returns the V x K matrix of the current topic-word probabilities 
+        (N_kw + eta) / (N_k + V eta) 
+        """
+        
+        return ((self.beta_counts + self.eta).T 
+                / (self.topic_counts + self.vocab_size * self.eta))
+    
+    def partial_fit(self, docs):
+        """Updates the topic-word statistics with a minibatch of documents. 
+        Returns the topic proportions of the documents (K x len(docs)). 
+        """
+        
+        docs = list(docs)
+        if not docs: 
+            return zeros((self.num_topics, 0))
+        theta, batch_counts = fold_in(docs, self.word_topic(), self.alpha, 
+                                      self.num_sweeps, self.method, self.rng, 
+                                      return_word_topic=True)
+        
+        rho = (self.tau0 + self.num_updates) ** -self.kappa 
+        self.beta_counts *= 1. - rho 
+        self.beta_counts += (rho * self.corpus_size / len(docs)) * batch_counts 
+        self.topic_counts = self.beta_counts.sum(axis=1)
+        self.num_updates += 1
+        self.num_seen_docs += len(docs)
+        
+        return theta 
+    
+    def fit(self, corpus, num_passes=1, message_interval=10):
+        """Runs num_passes passes over the corpus, any iterable of documents 
+        in the bag-of-words format (e.g., a gensim BleiCorpus), which is 
+        read one minibatch at a time. 
+        
+        Arguments: 
+            corpus - the documents 
+            num_passes - the number of passes over the corpus 
+            message_interval - the number of minibatches between messages 
+        """
+        
+        for _ in xrange(num_passes): 
+            for batch in _iter_batches(corpus, self.batch_size): 
+                self.partial_fit(batch)
+                if self.num_updates % message_interval == 0: 
+                    print "lda_scgs: minibatch #%d (%d documents)" % (self.num_updates, 
+                                                                 self.num_seen_docs)
+    
+    def expected_beta(self):
+        """Returns the K x V matrix of the topic-word distributions, i.e., 
+        the posterior mean (N_kw + eta) / (N_k + V eta) 
+        """
+        
+        return self.word_topic().T 
+    
+    def transform(self, corpus, num_sweeps=20, method='gibbs', batch_size=256, 
+                  n_workers=1):
+        """Infers the topic proportions of documents given the current 
+        topic-word statistics (see AugmentedCollapsedGibbsSampler.transform) 
+        """
+        
+        assert(method in ('gibbs', 'cvb0'))
+        assert(num_sweeps > 0 and batch_size > 0 and n_workers > 0)
+        
+        return fold_in_corpus(corpus, self.word_topic(), self.alpha, num_sweeps, 
+                              method, batch_size, n_workers, self.random_seed)
+
+
+
+
+###############################################################################
+# Zero-order collapsed variational Bayes (CVB0) 
+###############################################################################
+
+class CollapsedVariationalBayes0(object):
+    """Fits LDA with the deterministic zero-order collapsed variational Bayes 
+    updates (CVB0, Asuncion et al., 2009) on the (word id, word count) pairs 
+    of the documents, i.e., the word instances are never expanded. 
+    
+    Every pair (d, w) with count c keeps a K-dimensional responsibility 
+    vector gamma_dw (float32). A sweep updates the documents one at a time, 
+    and all the pairs of a document at once: 
+    
+        gamma_dwk ∝ (N_dk^- + alpha_k) (N_wk^- + eta) / (N_k^- + V eta) 
+    
+    where N^- are the expected counts without the pair's own contribution 
+    c gamma_dw, and the counts are then updated with the changes. 
+    """
+    
+    def __init__(self, corpus, num_topics, vocab_size, alpha, eta, max_iter, 
+                 tol=1e-4, random_seed=1983):
+        """
+        Arguments: 
+            corpus - the documents in the bag-of-words format (e.g., a gensim 
+                     BleiCorpus), or the token arrays of load_ldac 
+            num_topics - the number of topics 
+            vocab_size - the vocabulary size 
+            alpha - the Dirichlet prior of theta, a scalar or num_topics 
+                    values 
+            eta - the symmetric Dirichlet prior of beta 
+            max_iter - the maximum number of sweeps 
+            tol - fit() stops once the mean absolute change of the 
+                  responsibilities in a sweep falls below tol 
+            random_seed - the seed of the random initial responsibilities 
+        """
+        
+        self.num_topics = num_topics
+        self.vocab_size = vocab_size
+        self.alpha = array(alpha, dtype=float64) * ones(num_topics)
+        self.eta = float(eta)
+        self.max_iter = max_iter
+        self.tol = tol
+        self.random_seed = random_seed
+        
+        assert(self.num_topics > 1)
+        assert(self.vocab_size > 1)
+        assert(self.alpha.shape == (num_topics,) and (self.alpha > 0.).all())
+        assert(self.eta > 0.)
+        assert(self.max_iter > 0)
+        
+        pairs = corpus_to_pairs(corpus)
+        self.word_ids = pairs['word_ids']
+        self.counts = pairs['counts']
+        self.doc_lengths = pairs['doc_lengths']
+        self.num_docs = len(self.doc_lengths)
+        self.num_pairs = len(self.word_ids)
+        self.doc_offsets = zeros(self.num_docs + 1, dtype=int64)
+        cumsum(bincount(pairs['doc_ids'], minlength=self.num_docs), 
+               out=self.doc_offsets[1:])
+        
+        self.beta_mean, self.theta_mean = None, None 
+    
+    def initialize_state(self):
+        """Initializes the responsibilities randomly and computes the 
+        expected counts N_wk (V x K), N_dk (D x K), and N_k from them 
+        """
+        
+        rng = RandomState(self.random_seed)
+        self.resps = rng.random_sample((self.num_pairs, self.num_topics)).astype(float32)
+        self.resps /= self.resps.sum(axis=1, keepdims=True)
+        
+        weighted = self.resps * self.counts[:, newaxis]
+        self.word_topic = zeros((self.vocab_size, self.num_topics))
+        add.at(self.word_topic, self.word_ids, weighted)
+        self.doc_topic = zeros((self.num_docs, self.num_topics))
+        doc_ids = repeat(arange(self.num_docs), diff(self.doc_offsets))
+        add.at(self.doc_topic, doc_ids, weighted)
+        self.topic_counts = self.word_topic.sum(axis=0)
+        self.iteration = 0
+        self.changes = []
+    
+    def fit(self, message_interval=10, verbose=True):
+        """Runs CVB0 sweeps until the responsibilities converge (see tol) or 
+        for max_iter sweeps, and computes the estimates self.beta_mean 
+        (K x V) and self.theta_mean (K x D), in the shapes of the Gibbs 
+        sampler's Beta and Theta samples. The mean absolute change of the 
+        responsibilities in every sweep is kept in self.changes. 
+        """
+        
+        self.initialize_state()
+        while self.iteration < self.max_iter: 
+            change = self._sweep()
+            self.iteration += 1
+            self.changes.append(change)
+            if verbose and self.iteration % message_interval == 0: 
+                print "lda_cvb0: iter #%d, mean change %.2e" % (self.iteration, change)
+            if change < self.tol: 
+                break 
+        
+        self.beta_mean = ((self.word_topic + self.eta) 
+                          / (self.topic_counts + self.vocab_size * self.eta)).T
+        self.theta_mean = ((self.doc_topic + self.alpha) 
+                           / (self.doc_lengths + self.alpha.sum())[:, newaxis]).T
+    
+    def _sweep(self):
+        """Runs one CVB0 sweep and returns the mean absolute change of the 
+        responsibilities 
+        """
+        
+        vocab_size_x_eta = self.vocab_size * self.eta
+        word_topic = self.word_topic
+        doc_topic = self.doc_topic
+        topic_counts = self.topic_counts
+        total_change = 0.
+        
+        for did in xrange(self.num_docs): # for each document 
+            start, end = self.doc_offsets[did], self.doc_offsets[did + 1]
+            if start == end: continue 
+            wids = self.word_ids[start:end]
+            counts = self.counts[start:end, newaxis]
+            old_resps = self.resps[start:end]
+            own = counts * old_resps # the pairs' own expected counts 
+            
+            resps = maximum(doc_topic[did] - own, 0.) + self.alpha 
+            resps *= maximum(word_topic[wids] - own, 0.) + self.eta 
+            resps /= maximum(topic_counts - own, 0.) + vocab_size_x_eta 
+            resps /= resps.sum(axis=1, keepdims=True)
+            
+            delta = counts * (resps - old_resps)
+            doc_topic[did] += delta.sum(axis=0)
+            add.at(word_topic, wids, delta)
+            topic_counts += delta.sum(axis=0)
+            total_change += abs(resps - old_resps).sum()
+            self.resps[start:end] = resps 
+        
+        return total_change / max(self.num_pairs * self.num_topics, 1)
+    
+    def transform(self, corpus, num_sweeps=20, method='cvb0', batch_size=256, 
+                  n_workers=1):
+        """Infers the topic proportions of new documents given the fitted 
+        topics (see AugmentedCollapsedGibbsSampler.transform) 
+        """
+        
+        assert(method in ('gibbs', 'cvb0'))
+        assert(num_sweeps > 0 and batch_size > 0 and n_workers > 0)
+        
+        return fold_in_corpus(corpus, self.beta_mean.T, self.alpha, num_sweeps, 
+                              method, batch_size, n_workers, self.random_seed)
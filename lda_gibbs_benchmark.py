@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks the LDA samplers (the sampling modes of the Augmented Collapsed
+Gibbs sampler, AD-LDA, the block-diagonal parallel sampler, and the
+stochastic minibatch sampler) over a matrix
+of corpora and numbers of topics.
+
+Every run fits a sampler for a fixed time budget in its own process and
+records the throughput (word instances per second), the peak resident set
+size of the process, and the joint log-likelihood log p(w, z) at the end of
+the budget (for the stochastic sampler, which keeps no z, the log predictive
+probability of the corpus given its fold-in topic proportions). The results
+are written to a JSON file, so that runs can be compared over time, e.g.,
+
+    python lda_gibbs_benchmark.py --budget 30 --output bench.json
+
+Created on Sun Oct 18 2026
+"""
+
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+
+from datetime import datetime
+from multiprocessing import Process, Pipe
+from os.path import join, dirname, abspath
+from time import time
+
+import numpy
+from numpy import zeros, hstack, cumsum, repeat, arange, int32, log, minimum
+from numpy.random import RandomState
+
+from lda_gibbs import AugmentedCollapsedGibbsSampler, \
+    StochasticCollapsedGibbsSampler, load_ldac, fold_in
+
+
+###############################################################################
+# Corpora
+###############################################################################
+
+DATA_DIR = join(dirname(abspath(__file__)), 'datasets')
+
+ENGINES = ['standard', 'sparse', 'alias', 'vectorized', 'adlda', 'blocks',
+           'stochastic']
+
+
+def replicate_corpus(corpus, num_copies):
+    """Concatenates num_copies copies of the token arrays of a corpus"""
+
+    doc_lengths = hstack([corpus['doc_lengths']] * num_copies)
+    return {'word_ids': hstack([corpus['word_ids']] * num_copies),
+            'doc_ids': repeat(arange(len(doc_lengths), dtype=int32), doc_lengths),
+            'doc_lengths': doc_lengths}
+
+
+def synthetic_corpus(num_docs, vocab_size, num_topics, doc_length, alpha=.1,
+                     eta=.01, random_seed=1983):
+    """Draws the token arrays of a corpus from the LDA generative process
+    with Poisson(doc_length) document lengths
+    """
+
+    rng = RandomState(random_seed)
+    beta = rng.dirichlet([eta] * vocab_size, size=num_topics)
+    theta = rng.dirichlet([alpha] * num_topics, size=num_docs)
+    doc_lengths = rng.poisson(doc_length, size=num_docs).astype(int32) + 1
+    doc_ids = repeat(arange(num_docs, dtype=int32), doc_lengths)
+
+    # inverse cdf draws of the topics and then of the words
+    topic_cdf = cumsum(theta, axis=1)
+    z = (topic_cdf[doc_ids] < rng.random_sample(len(doc_ids))[:, None]).sum(axis=1)
+    z[z == num_topics] = num_topics - 1
+    uniforms = rng.random_sample(len(z))
+    word_ids = zeros(len(z), dtype=int32)
+    for k in xrange(num_topics):
+        in_topic = (z == k)
+        word_ids[in_topic] = cumsum(beta[k]).searchsorted(uniforms[in_topic])
+    minimum(word_ids, vocab_size - 1, out=word_ids) # rounding errors
+
+    return {'word_ids': word_ids, 'doc_ids': doc_ids, 'doc_lengths': doc_lengths}
+
+
+def corpus_matrix(quick=False):
+    """Returns the benchmark corpora as a list of (name, loader, vocab_size)
+    tuples. The loaders are called in the run processes, so the corpora do
+    not count toward the peak memory of the parent.
+    """
+
+    whales_tires = join(DATA_DIR, 'whales-tires.ldac')
+    vocab_size = sum(1 for _ in open(whales_tires + '.vocab'))
+    corpora = [('whales-tires', lambda: load_ldac(whales_tires), vocab_size)]
+    for num_copies in ([4] if quick else [4, 16]):
+        corpora.append(('whales-tires-x%d' % num_copies,
+                        lambda n=num_copies: replicate_corpus(load_ldac(whales_tires), n),
+                        vocab_size))
+    for num_docs, vocab_size in ([(500, 1000)] if quick else
+                                 [(500, 1000), (5000, 5000), (20000, 20000)]):
+        corpora.append(('synthetic-D%d-V%d' % (num_docs, vocab_size),
+                        lambda d=num_docs, v=vocab_size: synthetic_corpus(d, v, 20, 100),
+                        vocab_size))
+
+    return corpora
+
+
+###############################################################################
+# Runs
+###############################################################################
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2.**20 if sys.platform == 'darwin' else 2.**10)
+
+
+def _stochastic_log_likelihood(sampler, corpus):
+    """Computes the per-word log predictive probability of the corpus given
+    the fold-in topic proportions of its documents (a proxy of the
+    log-likelihood for the stochastic sampler, which keeps no z)
+    """
+
+    word_topic = sampler.word_topic()
+    offsets = hstack([[0], cumsum(corpus['doc_lengths'])])
+    docs = [zip(*numpy.unique(corpus['word_ids'][offsets[d]:offsets[d + 1]],
+                              return_counts=True))
+            for d in xrange(len(corpus['doc_lengths']))]
+    theta = fold_in(docs, word_topic, sampler.alpha, 5, 'cvb0', RandomState(0))
+    probs = (word_topic[corpus['word_ids']] * theta[:, corpus['doc_ids']].T).sum(axis=1)
+
+    return log(probs).sum()
+
+
+def _run(engine, corpus_loader, vocab_size, num_topics, budget, conn):
+    """Runs an engine for budget seconds in a child process and sends back
+    the result
+    """
+
+    corpus = corpus_loader()
+    num_tokens = len(corpus['word_ids'])
+    alpha, eta = 50. / num_topics, .1
+    result = {'num_docs': len(corpus['doc_lengths']), 'num_tokens': num_tokens}
+
+    if engine == 'stochastic':
+        num_docs = len(corpus['doc_lengths'])
+        offsets = hstack([[0], cumsum(corpus['doc_lengths'])])
+        docs = [zip(*numpy.unique(corpus['word_ids'][offsets[d]:offsets[d + 1]],
+                                  return_counts=True))
+                for d in xrange(num_docs)]
+        sampler = StochasticCollapsedGibbsSampler(num_topics, vocab_size, alpha,
+                                                  eta, num_docs)
+        start = time()
+        num_passes = 0
+        while time() - start < budget:
+            sampler.fit(docs, num_passes=1, message_interval=sys.maxint)
+            num_passes += 1
+        elapsed = time() - start
+        result.update({'iterations': num_passes,
+                       'tokens_per_sec': num_passes * num_tokens / elapsed,
+                       'log_likelihood': _stochastic_log_likelihood(sampler, corpus),
+                       'log_likelihood_kind': 'fold-in predictive'})
+    else:
+        parallel = engine if engine in ('adlda', 'blocks') else 'adlda'
+        mode = 'vectorized' if engine in ('adlda', 'blocks') else engine
+        n_workers = 2 if engine in ('adlda', 'blocks') else 1
+        sampler = AugmentedCollapsedGibbsSampler(corpus, num_topics, vocab_size,
+                                                 alpha, eta, 10**9, 10**9 - 1,
+                                                 mode=mode, n_workers=n_workers,
+                                                 parallel=parallel)
+        def stop_at_budget(sampler, metrics):
+            return time() - start >= budget
+        start = time()
+        sampler.fit(message_interval=10**9, callbacks=[stop_at_budget],
+                    verbose=False)
+        sampling_time = sum(m['sampling_time'] for m in sampler.metrics)
+        result.update({'iterations': sampler.iteration,
+                       'tokens_per_sec': (sampler.iteration * num_tokens
+                                          / sampling_time),
+                       'log_likelihood': sampler.log_likelihood(),
+                       'log_likelihood_kind': 'joint',
+                       'changed_fraction': sampler.metrics[-1]['changed_fraction']})
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    conn.send(result)
+    conn.close()
+
+
+def run_benchmark(engines, num_topics_list, budget, quick=False):
+    """Runs every engine on every corpus for every number of topics, each
+    in a fresh process, and returns the list of results
+    """
+
+    results = []
+    for corpus_name, corpus_loader, vocab_size in corpus_matrix(quick):
+        for num_topics in num_topics_list:
+            for engine in engines:
+                parent_conn, child_conn = Pipe()
+                process = Process(target=_run,
+                                  args=(engine, corpus_loader, vocab_size,
+                                        num_topics, budget, child_conn))
+                process.start()
+                result = parent_conn.recv()
+                process.join()
+                result.update({'engine': engine, 'corpus': corpus_name,
+                               'vocab_size': vocab_size,
+                               'num_topics': num_topics, 'budget': budget})
+                print "%-12s %-24s K=%-4d %10.0f tokens/sec %8.1f MB  ll %.1f" % (
+                    engine, corpus_name, num_topics, result['tokens_per_sec'],
+                    result['peak_rss_mb'], result['log_likelihood'])
+                results.append(result)
+
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=dirname(abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--topics', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--budget', type=float, default=10.,
+                        help='the time budget of a run (in seconds)')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the smaller corpora')
+    parser.add_argument('--output', default='lda_gibbs_benchmark.json')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.engines, args.topics, args.budget, args.quick)
+    report = {'timestamp': datetime.now().isoformat(),
+              'commit': _git_commit(),
+              'python': platform.python_version(),
+              'numpy': numpy.__version__,
+              'platform': platform.platform(),
+              'results': results}
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+    print "Results saved to %s" % args.output